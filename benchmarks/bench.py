@@ -0,0 +1,208 @@
+"""Benchmark the maze generator stages across maze sizes and batch counts.
+
+Every (size, batch) case runs in its own process, in a temporary folder,
+through the same calls as main.ipynb and coe_gen.ipynb:
+
+    make_maze      gridMazeGen(...), carving the batch
+    gen_next_state gridMazeGen.generate_ns
+    gen_rewards    gridMazeGen.generate_rt
+    write_svg      gridMazeGen.generate_maze_svg / generate_maze_png
+    config_txt     gridMazeGen.generate_config_txt
+    config_bin     gridMazeGen.generate_config_bin
+    load_config    COEgen.load_mazeConfig (txt)
+    gen_COE        COEgen.set_goals + COEgen.gen_COE
+
+Each stage records its wall time, peak RSS and output bytes as one JSON
+line, tagged with the git commit, so runs of different commits can be
+compared:
+
+    python benchmarks/bench.py --sizes 5 40 256 1024 --batches 1 4
+    python benchmarks/bench.py --compare before.jsonl after.jsonl
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from os import chdir, walk
+from os.path import abspath, dirname, getsize, join
+from time import perf_counter
+
+REPO_DIR = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+
+from lib.instrument import peak_rss, reset_peak_rss
+
+SIZES = [5, 10, 20, 40, 64, 128, 256, 512, 1024, 2048, 4096]
+BATCHES = [1, 4]
+STAGES = ['make_maze', 'gen_next_state', 'gen_rewards', 'write_svg', 'config_txt', 'config_bin',
+          'load_config', 'gen_COE']
+
+def tree_bytes(path):
+    return sum(getsize(join(root, file)) for root, _, files in walk(path) for file in files)
+
+def svg_mode_for(size, svg_mode):
+    # Full SVGs don't scale past a few hundred cells per side
+    if svg_mode != 'auto':
+        return svg_mode
+    return 'full' if size <= 64 else 'compact' if size <= 1024 else 'png'
+
+def run_case(size, batch, algorithm, workers, svg_mode, stages):
+    """Run the stages of a case in the current folder, return one record per stage."""
+
+    from lib.support import gridMazeGen
+    from lib.coe_gen import COEgen
+
+    records = []
+    state = {}
+
+    def stage(name, fn):
+        if name not in stages:
+            return
+        reset_peak_rss()
+        before = tree_bytes('.')
+        start = perf_counter()
+        fn()
+        seconds = perf_counter() - start
+        records.append({'stage': name, 'seconds': seconds, 'peak_rss_kb': peak_rss(),
+                        'bytes': tree_bytes('.') - before})
+
+    def make_maze():
+        state['gen'] = gridMazeGen(batch, size, 'results', algorithm=algorithm, seed=0, workers=workers,
+                                   svg_mode=svg_mode_for(size, svg_mode), catalog=False, verbose=0)
+        state['dirs'] = []
+        for idx, maze in enumerate(state['gen'].mazes):
+            state['dirs'].append(state['gen'].check_dir(join(state['gen'].results_dir, f'maze_{idx}')))
+
+    def for_mazes(fn):
+        gen = state['gen']
+        for idx, (maze, target_dir) in enumerate(zip(gen.mazes, state['dirs'])):
+            fn(gen, maze, idx, target_dir)
+
+    def write_svg(gen, maze, idx, target_dir):
+        if gen.svg_mode == 'png':
+            gen.generate_maze_png(maze, idx, target_dir, '')
+        else:
+            gen.generate_maze_svg(maze, idx, target_dir, 's', '')
+            gen.generate_maze_svg(maze, idx, target_dir, 'c', '')
+
+    def load_config():
+        state['coe'] = []
+        for target_dir in state['dirs']:
+            coe = COEgen('results', verbose=0)
+            coe.target_dir = target_dir
+            coe.config_file = coe.config_files(target_dir)[0]
+            coe.load_mazeConfig()
+            state['coe'].append(coe)
+
+    def gen_coe():
+        for coe in state['coe']:
+            coe.set_goals(0)
+            coe.gen_COE(16, 8)
+
+    stage('make_maze', make_maze)
+    stage('gen_next_state', lambda: state['gen'].generate_ns())
+    stage('gen_rewards', lambda: state['gen'].generate_rt())
+    stage('write_svg', lambda: for_mazes(write_svg))
+    stage('config_txt', lambda: for_mazes(lambda gen, maze, idx, d: gen.generate_config_txt(maze, idx, d, '')))
+    stage('config_bin', lambda: for_mazes(lambda gen, maze, idx, d: gen.generate_config_bin(maze, idx, d, '')))
+    if 'config_txt' in stages:
+        stage('load_config', load_config)
+        if 'load_config' in stages:
+            stage('gen_COE', gen_coe)
+    return records
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_sweep(args):
+    common = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'algorithm': args.algorithm,
+        'workers': args.workers,
+    }
+    with open(args.out, 'a') as out:
+        for size in args.sizes:
+            for batch in args.batches:
+                case = dict(common, size=size, batch=batch, svg_mode=svg_mode_for(size, args.svg_mode))
+                cmd = [sys.executable, abspath(__file__), '--case', str(size), str(batch),
+                       '--algorithm', args.algorithm, '--workers', str(args.workers),
+                       '--svg-mode', args.svg_mode, '--stages', *args.stages]
+                try:
+                    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=args.timeout)
+                    if proc.returncode != 0:
+                        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else proc.returncode)
+                    records = [json.loads(line) for line in proc.stdout.splitlines() if line.startswith('{')]
+                except (subprocess.TimeoutExpired, RuntimeError) as error:
+                    records = [{'stage': None, 'error': str(error) or type(error).__name__}]
+                for record in records:
+                    out.write(json.dumps(dict(case, **record)) + '\n')
+                    out.flush()
+                    if record['stage'] is None:
+                        print(f"{size}x{size} x{batch}: {record['error']}")
+                    else:
+                        print(f"{size}x{size} x{batch} {record['stage']:<15}{record['seconds']:10.3f} s"
+                              f"{record['peak_rss_kb'] / 1024:10.1f} MB{record['bytes'] / 2**20:10.1f} MB out")
+
+def compare(before_file, after_file):
+    """Print the time and peak RSS ratios of the stages of two result files."""
+
+    def load(fname):
+        results = {}
+        with open(fname) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('stage') is not None:
+                    # Keep the last run of each case
+                    results[(record['size'], record['batch'], record['stage'])] = record
+        return results
+
+    before, after = load(before_file), load(after_file)
+    print(f"{'size':>6}{'batch':>6} {'stage':<15}{'before s':>10}{'after s':>10}{'time':>8}{'rss':>8}")
+    for key in sorted(before.keys() & after.keys(), key=lambda k: (k[0], k[1], STAGES.index(k[2]))):
+        b, a = before[key], after[key]
+        time_ratio = a['seconds'] / b['seconds'] if b['seconds'] > 0 else float('inf')
+        rss_ratio = a['peak_rss_kb'] / b['peak_rss_kb'] if b['peak_rss_kb'] > 0 else float('inf')
+        print(f"{key[0]:>6}{key[1]:>6} {key[2]:<15}{b['seconds']:10.3f}{a['seconds']:10.3f}"
+              f"{time_ratio:7.2f}x{rss_ratio:7.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the maze generator stages across maze sizes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='maze sizes (cells per side)')
+    parser.add_argument('--batches', type=int, nargs='+', default=BATCHES, help='mazes per batch')
+    parser.add_argument('--algorithm', default='dfs')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--svg-mode', choices=('auto', 'full', 'compact', 'png'), default='auto',
+                        help='auto: full up to 64, compact up to 1024, png above')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds per case')
+    parser.add_argument('--out', default=join(REPO_DIR, 'benchmarks', 'results.jsonl'),
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    parser.add_argument('--case', type=int, nargs=2, metavar=('SIZE', 'BATCH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.case:
+        # A single case, run by run_sweep in its own process
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            chdir(tmp_dir)
+            for record in run_case(*args.case, args.algorithm, args.workers, args.svg_mode, args.stages):
+                print(json.dumps(record), flush=True)
+    else:
+        run_sweep(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Check the import time of the headless generator modules against a budget.
+
+Short-lived generator processes pay the interpreter start and the imports
+of every job. This runs fresh interpreters importing numpy, then
+lib.support and lib.coe_gen, and times the imports of the package on top of
+numpy (the median of --runs processes). It fails when:
+
+- the median exceeds --budget-ms
+- a module kept out of the headless path (notebook, visualization, or only
+  needed by some features) was imported
+
+    python benchmarks/startup.py --runs 20 --budget-ms 10
+"""
+import argparse
+import json
+import subprocess
+import sys
+from os.path import abspath, dirname
+from statistics import median
+
+REPO_DIR = dirname(dirname(abspath(__file__)))
+
+MODULES = ['lib.support', 'lib.coe_gen']
+# Loaded on first use only
+LAZY = ['IPython', 'rig', 'base64', 'argparse', 'sqlite3', 'logging', 'hashlib', 'shutil',
+        'concurrent.futures', 'lib.render', 'lib.cache']
+
+PROBE = f"""
+import sys, json
+from time import perf_counter
+start = perf_counter()
+import numpy
+numpy_done = perf_counter()
+for module in {MODULES!r}:
+    __import__(module)
+done = perf_counter()
+print(json.dumps({{'numpy_ms': (numpy_done - start) * 1e3, 'lib_ms': (done - numpy_done) * 1e3,
+                  'loaded': [m for m in {LAZY!r} if m in sys.modules]}}))
+"""
+
+def probe():
+    proc = subprocess.run([sys.executable, '-c', PROBE], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the headless modules.')
+    parser.add_argument('--runs', type=int, default=20, help='interpreters to start')
+    parser.add_argument('--budget-ms', type=float, default=10, help='median import time of the package on top of numpy')
+    args = parser.parse_args()
+
+    # The first run compiles the modules when their bytecode isn't cached
+    probe()
+    runs = [probe() for _ in range(args.runs)]
+    numpy_ms = median(run['numpy_ms'] for run in runs)
+    lib_ms = median(run['lib_ms'] for run in runs)
+    loaded = sorted({module for run in runs for module in run['loaded']})
+    print(f"numpy {numpy_ms:.1f} ms, {', '.join(MODULES)} {lib_ms:.1f} ms (budget {args.budget_ms:.1f} ms)")
+    if sys.dont_write_bytecode:
+        print('Bytecode is not written (PYTHONDONTWRITEBYTECODE), the times include compiling the uncached modules')
+
+    failed = False
+    if lib_ms > args.budget_ms:
+        print(f'Over budget by {lib_ms - args.budget_ms:.1f} ms')
+        failed = True
+    if loaded:
+        print(f"Imported by the headless modules: {', '.join(loaded)}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
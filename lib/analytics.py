@@ -0,0 +1,243 @@
+from os import replace, makedirs
+from os.path import join, isfile
+
+import numpy as np
+
+from lib.goals import GoalIndex
+# Maze analytics computed from the (N, Z) next-state matrix.
+#
+# - exits: number of moves out of each state (actions not hitting a wall),
+#   giving the dead ends (1 exit), corridors (2) and junctions (3+)
+# - distances: number of steps from every state to the nearest goal, by a
+#   breadth-first search walking the reverse transitions out of the goals
+# - distance tables: the distances to every goal, one row per goal
+# - optimal policy: an action of each state moving one step closer to the
+#   goal, taken from the distances of the next states
+#
+# MazeAnalytics keeps each result in its own .npy file, in a folder next to
+# the maze config, so they are computed once per maze.
+
+def exits(NS):
+    """Return the number of actions of each state that don't hit a wall."""
+
+    NS = np.asarray(NS)
+    return (NS != np.arange(NS.shape[0]).reshape(-1, 1)).sum(axis=1)
+
+def reverse_index(NS):
+    """Return the (indptr, predecessors) lists of the reverse transitions.
+
+    The states moving into state s are predecessors[indptr[s]:indptr[s+1]].
+
+    """
+    index = GoalIndex(NS)
+    return index.indptr.tolist(), (index.entries // index.Z).tolist()
+
+def bfs_distances(NS, sources, reverse=None):
+    """Return the number of steps from every state to the nearest source state.
+
+    Unreachable states get -1. reverse is the reverse_index of NS, pass it
+    to run many searches on the same maze.
+
+    """
+    indptr, pred = reverse_index(NS) if reverse is None else reverse
+    N = len(indptr) - 1
+    dist = [-1] * N
+    # Flat array queue: every state is queued at most once
+    queue = [0] * N
+    tail = 0
+    for s in np.atleast_1d(sources).tolist():
+        if dist[s] < 0:
+            dist[s] = 0
+            queue[tail] = s
+            tail += 1
+    head = 0
+    while head < tail:
+        s = queue[head]
+        head += 1
+        d = dist[s] + 1
+        for p in pred[indptr[s]:indptr[s + 1]]:
+            if dist[p] < 0:
+                dist[p] = d
+                queue[tail] = p
+                tail += 1
+    return np.array(dist, dtype=np.int32)
+
+def distance_table(NS, goals=None):
+    """Return the (G, N) distances from every state to each goal (every state by default)."""
+
+    NS = np.asarray(NS)
+    goals = range(NS.shape[0]) if goals is None else goals
+    reverse = reverse_index(NS)
+    return np.array([bfs_distances(NS, goal, reverse) for goal in goals], dtype=np.int32).reshape(-1, NS.shape[0])
+
+def optimal_actions(NS, dist):
+    """Return the (..., N, Z) mask of the actions moving one step closer to the goal.
+
+    dist is a distance field (N,) or a distance table (G, N).
+
+    """
+    NS = np.asarray(NS)
+    next_dist = np.take(dist, NS, axis=-1)
+    here = np.expand_dims(dist, -1)
+    return (here > 0) & (next_dist == here - 1)
+
+def optimal_policy(NS, dist):
+    """Return an optimal action of each state, the first in action order.
+
+    Goals and states that can't reach the goal get -1.
+
+    """
+    best = optimal_actions(NS, dist)
+    return np.where(best.any(axis=-1), best.argmax(axis=-1), -1).astype(np.int8)
+
+def solution_path(NS, dist, start):
+    """Return the states of a shortest path from start to the goal of dist, start included."""
+
+    NS = np.asarray(NS)
+    if dist[start] < 0:
+        raise ValueError(f'State {start} does not reach the goal')
+    policy = optimal_policy(NS, dist)
+    path = [start]
+    state = start
+    while dist[state] > 0:
+        state = int(NS[state, policy[state]])
+        path.append(state)
+    return path
+
+def maze_stats(NS, dist=None):
+    """Return a dict of the structure of a maze, and of its distances to the goal when given."""
+
+    ex = exits(NS)
+    stats = {
+        'states': int(ex.size),
+        'dead_ends': int((ex == 1).sum()),
+        'corridors': int((ex == 2).sum()),
+        'junctions': int((ex >= 3).sum()),
+        'branching': float(ex.mean()),
+    }
+    if dist is not None:
+        reached = dist[dist >= 0]
+        stats['reachable'] = int(reached.size)
+        stats['max_distance'] = int(reached.max())
+        stats['mean_distance'] = float(reached.mean())
+    return stats
+
+def ns_digest(NS):
+    """Return the digest of an NS matrix, tying cached results to it."""
+
+    # hashlib loads OpenSSL, only import it when analytics are used
+    import hashlib
+    return hashlib.sha1(np.ascontiguousarray(NS, dtype='<i8').data).hexdigest()
+
+class MazeAnalytics:
+    """Analytics of a maze, computed on first use and kept in cache_dir.
+
+    Each result is a {name}.npy file of cache_dir, written when computed and
+    read when first used. The folder is tied to the NS matrix by a digest,
+    the results of another maze are removed.
+
+    """
+
+    def __init__(self, NS, cache_dir=None):
+        self.NS = np.asarray(NS)
+        self.cache_dir = cache_dir
+        self.digest = ns_digest(self.NS)
+        self.results = {}
+        self.reverse = None
+        if cache_dir is not None:
+            self.open_cache()
+
+    def open_cache(self):
+        # Keep the results of the cache folder only if they are of this NS
+        digest_file = join(self.cache_dir, 'digest')
+        if isfile(digest_file):
+            with open(digest_file) as f:
+                if f.read() == self.digest:
+                    return
+        from shutil import rmtree
+        rmtree(self.cache_dir, ignore_errors=True)
+        makedirs(self.cache_dir)
+        with open(digest_file, 'w') as f:
+            f.write(self.digest)
+
+    def cached(self, name, compute):
+        # Compute a result once, then store it in its own file
+        if name not in self.results:
+            fname = None if self.cache_dir is None else join(self.cache_dir, f'{name}.npy')
+            if fname is not None and isfile(fname):
+                self.results[name] = np.load(fname)
+            else:
+                self.results[name] = compute()
+                self.save(name)
+        return self.results[name]
+
+    def save(self, name):
+        if self.cache_dir is None:
+            return
+        fname = join(self.cache_dir, f'{name}.npy')
+        tmp_file = fname + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.save(f, self.results[name])
+        replace(tmp_file, fname)
+
+    def apply_diff(self, diff):
+        """Update the analytics after a wall edit, diff as returned by Maze.set_walls.
+
+        The exits of the edited states are updated in place, the distances
+        and policies depend on the whole maze and are dropped, to be
+        computed again on first use.
+
+        """
+        states, actions = diff['state'], diff['action']
+        if not len(states):
+            return
+        self.NS = np.array(self.NS)
+        self.NS[states, actions] = diff['ns']
+        self.digest = ns_digest(self.NS)
+        self.reverse = None
+        exit_count = self.results.get('exits')
+        self.results = {}
+        if exit_count is not None:
+            edited = np.unique(states)
+            exit_count = exit_count.copy()
+            exit_count[edited] = (self.NS[edited] != edited.reshape(-1, 1)).sum(axis=1)
+            self.results['exits'] = exit_count
+        if self.cache_dir is not None:
+            # Results of the maze before the edit are removed
+            self.open_cache()
+            for name in self.results:
+                self.save(name)
+
+    def reverse_index(self):
+        if self.reverse is None:
+            self.reverse = reverse_index(self.NS)
+        return self.reverse
+
+    def exits(self):
+        return self.cached('exits', lambda: exits(self.NS))
+
+    def distances(self, goal):
+        """Return the distances from every state to goal."""
+
+        return self.cached(f'dist_{goal}', lambda: bfs_distances(self.NS, goal, self.reverse_index()))
+
+    def distance_table(self):
+        """Return the (N, N) distances from every state (columns) to every goal (rows)."""
+
+        return self.cached('dist_all', lambda: distance_table(self.NS))
+
+    def policy(self, goal):
+        """Return the optimal policy of goal."""
+
+        return self.cached(f'policy_{goal}', lambda: optimal_policy(self.NS, self.distances(goal)))
+
+    def policy_table(self):
+        """Return the (N, N) optimal policies of every goal (rows)."""
+
+        return self.cached('policy_all', lambda: optimal_policy(self.NS, self.distance_table()))
+
+    def solution_path(self, start, goal):
+        return solution_path(self.NS, self.distances(goal), start)
+
+    def stats(self, goal=None):
+        return maze_stats(self.NS, None if goal is None else self.distances(goal))
@@ -0,0 +1,70 @@
+import numpy as np
+
+from lib import carve
+from lib import map_gen as mg
+# Batches of mazes as tensors.
+#
+# Instead of one Maze object per maze, a batch of B mazes of the same size is
+# carved at once into a (B, ny, nx) wall tensor with the batched row-local
+# algorithms of lib/carve.py (binary_tree, sidewinder, eller), and its
+# matrices are built as stacked (B, N, Z) NS/RT arrays, the layout taken by
+# lib/solver.py. Thousands of small mazes cost a few NumPy calls instead of
+# thousands of Python objects.
+
+def carve_batch(B, dim, algorithm='binary_tree', rng=None):
+    """Return the (B, ny, nx) uint8 walls of B mazes of size dim (a size or (nx, ny))."""
+
+    if algorithm not in carve.BATCH_ALGORITHMS:
+        raise ValueError(f"Unknown batch maze algorithm '{algorithm}'. "
+                         f"Choose from {', '.join(carve.BATCH_ALGORITHMS)}.")
+    nx, ny = mg.maze_size(dim)
+    rng = np.random.default_rng(rng)
+    open_s, open_e = carve.BATCH_ALGORITHMS[algorithm](B, nx, ny, rng)
+    return mg.walls_from_passages(open_s, open_e)
+
+def matrices_from_batch(walls, r_default=-1, r_wall=-10, actions=4):
+    """Return the (B, N, Z) int32 NS and float32 RT matrices of a (B, ny, nx) wall tensor."""
+
+    B, ny, nx = walls.shape
+    N = nx*ny
+    steps = np.array([dx + nx*dy for dx, dy in (mg.ACTION_STEPS[action] for action in mg.ACTION_MODELS[actions])],
+                     dtype=np.int32)
+    states = np.arange(N, dtype=np.int32).reshape(-1, 1)
+    if actions == 4:
+        # The moves of a cell only depend on its wall nibble: look the
+        # steps and rewards of the 16 nibbles up
+        nibbles = np.arange(16, dtype=np.uint8)
+        blocked = mg.walls_to_blocked(nibbles.reshape(1, -1))
+        step_lut = np.where(blocked, 0, steps).astype(np.int32)
+        reward_lut = np.where(blocked, r_wall, r_default).astype(np.float32)
+        return states + step_lut[walls.reshape(B, N)], reward_lut[walls.reshape(B, N)]
+    blocked = mg.walls_to_blocked(walls, actions).reshape(B, N, -1)
+    ns = np.where(blocked, states, states + steps)
+    rt = np.where(blocked, np.float32(r_wall), np.float32(r_default))
+    return ns, rt
+
+def maze_batch(B, dim, algorithm='binary_tree', seed=None, r_default=-1, r_wall=-10, actions=4):
+    """Return (walls, NS, RT) of B mazes carved at once, see carve_batch and matrices_from_batch."""
+
+    walls = carve_batch(B, dim, algorithm, seed)
+    ns, rt = matrices_from_batch(walls, r_default, r_wall, actions)
+    return walls, ns, rt
+
+def batch_maze(walls, idx, ns=None, rt=None, algorithm='binary_tree', r_default=-1, r_wall=-10):
+    """Return maze idx of a batch as a Maze, to draw, save or edit it as the generated ones.
+
+    The maze gets copies of its rows of the batch, editing it leaves the
+    batch untouched. r_default and r_wall are the rewards the batch RT was
+    built with, used by the wall edits.
+
+    """
+    ny, nx = walls.shape[1:]
+    # Action models are named after their number of actions
+    maze = mg.Maze((nx, ny), algorithm, actions=4 if ns is None else ns.shape[2])
+    maze.walls = walls[idx].copy()
+    if ns is not None:
+        maze.state_transition_matrix = ns[idx].copy()
+    if rt is not None:
+        maze.reward_matrix = rt[idx].copy()
+    maze.r_default, maze.r_wall = r_default, r_wall
+    return maze
@@ -0,0 +1,192 @@
+import json
+import hashlib
+from os import makedirs, replace, remove, rmdir, open as os_open, close, O_CREAT, O_EXCL, O_WRONLY
+from os.path import join, isfile, isdir, getsize, getmtime, dirname
+from shutil import rmtree
+from time import time, sleep
+
+import numpy as np
+
+from lib import map_gen as mg
+from lib import maze_io
+# Content-addressed cache of generated mazes.
+#
+# A maze is fully determined by its generation parameters (size, algorithm,
+# seed) and its matrices by the rewards. Each cache entry is stored under the
+# SHA-256 of those parameters, in {cache_dir}/{key[:2]}/{key}/:
+# - walls.npy: the (ny, nx) wall nibbles
+# - config.mzb: the NS/RT matrices, in the binary config format of
+#   lib/maze_io.py, memory-mapped when loaded
+# index.json keeps the size and last use time of every entry. put only
+# updates the index in memory, save_index (once per batch) evicts the least
+# recently used entries when the cache grows past max_bytes and writes the
+# index, merged with the one on disk under index.lock so that processes
+# sharing the cache keep each other's entries.
+
+# Bump to invalidate every cache entry when the generation changes
+CACHE_VERSION = 1
+# A lock older than this (seconds) was left by a dead process
+LOCK_TIMEOUT = 30
+
+class MazeCache:
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        makedirs(cache_dir, exist_ok=True)
+        self.index_file = join(cache_dir, 'index.json')
+        self.lock_file = join(cache_dir, 'index.lock')
+        self.index = self.read_index()
+        # Keys discarded since the last save_index, not to be merged back
+        self.removed = set()
+
+    @staticmethod
+    def key(nx, ny, algorithm, seed, r_default, r_wall, actions=4, imperfect=None):
+        """Return the cache key (hex digest) of a set of generation parameters."""
+
+        params = {'version': CACHE_VERSION, 'nx': nx, 'ny': ny, 'algorithm': algorithm,
+                  'seed': maze_io.json_seed(seed), 'r_default': r_default, 'r_wall': r_wall}
+        # 4-connected keys are left as they were before the action models
+        if actions != 4:
+            params['actions'] = actions
+        if imperfect:
+            params['imperfect'] = imperfect
+        text = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def read_index(self):
+        if not isfile(self.index_file):
+            return {}
+        with open(self.index_file) as f:
+            return json.load(f)
+
+    def entry_dir(self, key):
+        return join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Return the cached (walls, NS, RT) of key, or None when not cached."""
+
+        if key not in self.index:
+            return None
+        entry_dir = self.entry_dir(key)
+        try:
+            walls = np.load(join(entry_dir, 'walls.npy'))
+            _, ns, rt = maze_io.read_config_bin(join(entry_dir, 'config.mzb'))
+        except (OSError, ValueError):
+            # Entry removed or damaged behind our back
+            self.discard(key)
+            return None
+        self.index[key]['last_used'] = time()
+        return walls, ns, rt
+
+    def put(self, key, walls, ns, rt, **params):
+        """Store the walls and matrices of a maze under key.
+
+        The index is only updated in memory, call save_index once the batch
+        is stored.
+
+        """
+
+        entry_dir = self.entry_dir(key)
+        makedirs(entry_dir, exist_ok=True)
+        np.save(join(entry_dir, 'walls.npy'), walls)
+        ny, nx = walls.shape
+        maze_io.write_config_bin(join(entry_dir, 'config.mzb'), ns, rt, nx=nx, ny=ny, **params)
+        size = getsize(join(entry_dir, 'walls.npy')) + getsize(join(entry_dir, 'config.mzb'))
+        self.index[key] = {'size': size, 'last_used': time()}
+        self.removed.discard(key)
+
+    def discard(self, key):
+        """Remove the entry of key from the cache."""
+
+        self.index.pop(key, None)
+        self.removed.add(key)
+        entry_dir = self.entry_dir(key)
+        rmtree(entry_dir, ignore_errors=True)
+        try:
+            rmdir(dirname(entry_dir))
+        except OSError:
+            # Other entries share the same prefix folder
+            pass
+
+    def size(self):
+        """Return the total size of the cached entries, in bytes."""
+
+        return sum(entry['size'] for entry in self.index.values())
+
+    def evict(self):
+        """Evict the least recently used entries until the cache fits in max_bytes."""
+
+        total = self.size()
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['size']
+            self.discard(key)
+
+    def lock(self):
+        # Exclusive lock file, broken when left behind by a dead process
+        while True:
+            try:
+                close(os_open(self.lock_file, O_CREAT | O_EXCL | O_WRONLY))
+                return
+            except FileExistsError:
+                try:
+                    if time() - getmtime(self.lock_file) > LOCK_TIMEOUT:
+                        remove(self.lock_file)
+                except OSError:
+                    pass
+                sleep(0.01)
+
+    def save_index(self):
+        """Merge the index with the one on disk, evict if needed and write it, atomically."""
+
+        self.lock()
+        try:
+            # Entries stored by other processes since the index was read
+            for key, entry in self.read_index().items():
+                if key in self.removed or not isdir(self.entry_dir(key)):
+                    continue
+                if key in self.index:
+                    self.index[key]['last_used'] = max(self.index[key]['last_used'], entry['last_used'])
+                else:
+                    self.index[key] = entry
+            self.evict()
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.index, f)
+            replace(tmp_file, self.index_file)
+            self.removed = set()
+        finally:
+            remove(self.lock_file)
+
+    def clear(self):
+        """Remove every entry of the cache."""
+
+        for key in list(self.index):
+            self.discard(key)
+        if isfile(self.index_file):
+            remove(self.index_file)
+
+    def maze(self, dim, algorithm='dfs', seed=0, r_default=-1, r_wall=-10, actions=4, imperfect=None):
+        """Return the carved Maze of the given parameters, with its NS/RT matrices.
+
+        The maze is served from the cache when it was generated before,
+        otherwise it is generated and stored.
+
+        """
+        if seed is None:
+            raise ValueError('Cached mazes need a seed')
+        maze = mg.Maze(dim, algorithm, seed, actions, imperfect)
+        key = self.key(maze.nx, maze.ny, algorithm, seed, r_default, r_wall, actions, maze.imperfect)
+        cached = self.get(key)
+        if cached is not None:
+            maze.walls, maze.state_transition_matrix, maze.reward_matrix = cached
+            maze.r_default, maze.r_wall = r_default, r_wall
+            self.save_index()
+        else:
+            maze.make_maze()
+            maze.gen_matrices(r_default, r_wall)
+            self.put(key, maze.walls, maze.state_transition_matrix, maze.reward_matrix,
+                     seed=seed, algorithm=algorithm, r_default=r_default, r_wall=r_wall)
+            self.save_index()
+        return maze
@@ -0,0 +1,451 @@
+import numpy as np
+# Maze carving algorithms.
+#
+# Every algorithm carves a perfect maze on a nx x ny grid and returns the
+# passages it opened as two (ny, nx) bool arrays:
+# - open_s[y, x] is True when (x,y) is connected to its south neighbour
+# - open_e[y, x] is True when (x,y) is connected to its east neighbour
+# Maze turns them into wall nibbles with map_gen.walls_from_passages().
+#
+# The sequential algorithms (dfs, kruskal, prim, wilson) run in plain Python
+# on flat bytearrays indexed by state number x+nx*y, with their random
+# numbers drawn in bulk from the NumPy generator. The row-local algorithms
+# (binary_tree, sidewinder) are fully vectorized, and with Eller's they
+# also have batched versions carving B mazes at once (BATCH_ALGORITHMS).
+
+def new_passages(nx, ny):
+    """Return empty flat (open_s, open_e) bytearrays for a nx x ny grid."""
+
+    return bytearray(nx*ny), bytearray(nx*ny)
+
+def as_passages(open_s, open_e, nx, ny):
+    """Return flat passage bytearrays as (ny, nx) bool arrays."""
+
+    open_s = np.frombuffer(open_s, dtype=np.uint8).reshape(ny, nx).astype(bool)
+    open_e = np.frombuffer(open_e, dtype=np.uint8).reshape(ny, nx).astype(bool)
+    return open_s, open_e
+
+def carve_dfs(nx, ny, rng, start=(0, 0)):
+    """Randomized depth-first search (recursive backtracker)."""
+
+    n = nx * ny
+    open_s, open_e = new_passages(nx, ny)
+    visited = bytearray(n)
+    # Preallocated stack of visited cells, sp is the stack pointer
+    stack = [0] * n
+    sp = 0
+    rand = rng.random(n).tolist()
+    cell = start[0] + nx*start[1]
+    visited[cell] = 1
+    nv = 1
+    neighbours = [0] * 4
+    while nv < n:
+        x = cell % nx
+        k = 0
+        # Unvisited neighbours, in the W, E, S, N order of the original DFS
+        if x > 0 and not visited[cell-1]:
+            neighbours[k] = cell-1
+            k += 1
+        if x < nx-1 and not visited[cell+1]:
+            neighbours[k] = cell+1
+            k += 1
+        if cell+nx < n and not visited[cell+nx]:
+            neighbours[k] = cell+nx
+            k += 1
+        if cell >= nx and not visited[cell-nx]:
+            neighbours[k] = cell-nx
+            k += 1
+
+        if not k:
+            # We've reached a dead end: backtrack.
+            sp -= 1
+            cell = stack[sp]
+            continue
+
+        # Choose a random neighbouring cell and move to it.
+        nxt = neighbours[int(rand[nv] * k)]
+        # Vertical moves first: in single column mazes cell+-1 is also cell+-nx
+        if nxt == cell+nx:
+            open_s[cell] = 1
+        elif nxt == cell-nx:
+            open_s[nxt] = 1
+        elif nxt > cell:
+            open_e[cell] = 1
+        else:
+            open_e[nxt] = 1
+        visited[nxt] = 1
+        stack[sp] = cell
+        sp += 1
+        cell = nxt
+        nv += 1
+    return as_passages(open_s, open_e, nx, ny)
+
+def carve_kruskal(nx, ny, rng, start=(0, 0)):
+    """Randomized Kruskal's algorithm on a union-find forest."""
+
+    n = nx * ny
+    open_s, open_e = new_passages(nx, ny)
+    # Edge e < n joins cell e with its east neighbour, edge e >= n joins cell
+    # e-n with its south neighbour. Drop the edges leaving the grid.
+    cells = np.arange(n).reshape(ny, nx)
+    east_edges = cells[:, :-1].ravel()
+    south_edges = cells[:-1, :].ravel() + n
+    edges = np.concatenate((east_edges, south_edges))
+    edges = edges[rng.permutation(edges.size)].tolist()
+
+    parent = list(range(n))
+    joined = 1
+    for e in edges:
+        if e < n:
+            a, b = e, e+1
+        else:
+            a, b = e-n, e-n+nx
+        # Find both roots with path halving
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        while parent[b] != b:
+            parent[b] = parent[parent[b]]
+            b = parent[b]
+        if a == b:
+            continue
+        parent[b] = a
+        if e < n:
+            open_e[e] = 1
+        else:
+            open_s[e-n] = 1
+        joined += 1
+        if joined == n:
+            break
+    return as_passages(open_s, open_e, nx, ny)
+
+def carve_prim(nx, ny, rng, start=(0, 0)):
+    """Randomized Prim's algorithm, growing the maze from the start cell."""
+
+    n = nx * ny
+    open_s, open_e = new_passages(nx, ny)
+    # 0: outside, 1: frontier, 2: in the maze
+    state = bytearray(n)
+    frontier = [0] * n
+    size = 0
+    rand = rng.random(2*n).tolist()
+    r = 0
+    cell = start[0] + nx*start[1]
+    neighbours = [0] * 4
+    while True:
+        state[cell] = 2
+        x = cell % nx
+        # Add the outside neighbours of the new cell to the frontier
+        for nb, ok in ((cell-1, x > 0), (cell+1, x < nx-1),
+                       (cell+nx, cell+nx < n), (cell-nx, cell >= nx)):
+            if ok and not state[nb]:
+                state[nb] = 1
+                frontier[size] = nb
+                size += 1
+        if not size:
+            break
+
+        # Pop a random frontier cell (swap with the last one)
+        i = int(rand[r] * size)
+        cell = frontier[i]
+        size -= 1
+        frontier[i] = frontier[size]
+
+        # Connect it to a random neighbour already in the maze
+        x = cell % nx
+        k = 0
+        if x > 0 and state[cell-1] == 2:
+            neighbours[k] = cell-1
+            k += 1
+        if x < nx-1 and state[cell+1] == 2:
+            neighbours[k] = cell+1
+            k += 1
+        if cell+nx < n and state[cell+nx] == 2:
+            neighbours[k] = cell+nx
+            k += 1
+        if cell >= nx and state[cell-nx] == 2:
+            neighbours[k] = cell-nx
+            k += 1
+        nb = neighbours[int(rand[r+1] * k)]
+        r += 2
+        # Vertical moves first: in single column mazes cell+-1 is also cell+-nx
+        if nb == cell+nx:
+            open_s[cell] = 1
+        elif nb == cell-nx:
+            open_s[nb] = 1
+        elif nb > cell:
+            open_e[cell] = 1
+        else:
+            open_e[nb] = 1
+    return as_passages(open_s, open_e, nx, ny)
+
+def carve_wilson(nx, ny, rng, start=(0, 0)):
+    """Wilson's algorithm (loop-erased random walks), a uniform spanning tree."""
+
+    n = nx * ny
+    open_s, open_e = new_passages(nx, ny)
+    in_maze = bytearray(n)
+    in_maze[start[0] + nx*start[1]] = 1
+    # Cell the walk left each cell towards, overwriting it erases the loops
+    exit_to = [0] * n
+    chunk = max(4*n, 1024)
+    steps = rng.integers(0, 4, size=chunk, dtype=np.uint8).tobytes()
+    r = 0
+    for walk_start in range(n):
+        if in_maze[walk_start]:
+            continue
+        # Random walk until it hits the maze
+        cell = walk_start
+        while not in_maze[cell]:
+            if r == chunk:
+                steps = rng.integers(0, 4, size=chunk, dtype=np.uint8).tobytes()
+                r = 0
+            step = steps[r]
+            r += 1
+            # Steps leaving the grid are dropped and redrawn
+            if step == 0:
+                if cell % nx == 0:
+                    continue
+                nxt = cell-1
+            elif step == 1:
+                if cell % nx == nx-1:
+                    continue
+                nxt = cell+1
+            elif step == 2:
+                if cell+nx >= n:
+                    continue
+                nxt = cell+nx
+            else:
+                if cell < nx:
+                    continue
+                nxt = cell-nx
+            exit_to[cell] = nxt
+            cell = nxt
+
+        # Add the loop-erased walk to the maze
+        cell = walk_start
+        while not in_maze[cell]:
+            nxt = exit_to[cell]
+            if nxt == cell+nx:
+                open_s[cell] = 1
+            elif nxt == cell-nx:
+                open_s[nxt] = 1
+            elif nxt > cell:
+                open_e[cell] = 1
+            else:
+                open_e[nxt] = 1
+            in_maze[cell] = 1
+            cell = nxt
+    return as_passages(open_s, open_e, nx, ny)
+
+def eller_rows(nx, ny, rng):
+    """Eller's algorithm, yielding the (open_s, open_e) bool rows one by one.
+
+    Only the set labels of the current row are kept, so memory is O(nx)
+    whatever the number of rows.
+
+    """
+    # Set label of every cell of the current row, -1 when not in a set yet
+    labels = [-1] * nx
+    parent = list(range(nx))
+    for y in range(ny):
+        last_row = (y == ny-1)
+        # Relabel the sets carried from the previous row as 0..k-1 and put
+        # the other cells in new singleton sets
+        relabel = {}
+        for x in range(nx):
+            lab = labels[x]
+            if lab < 0:
+                labels[x] = len(relabel) + nx
+                relabel[labels[x]] = len(relabel)
+            elif lab not in relabel:
+                relabel[lab] = len(relabel)
+            labels[x] = relabel[labels[x]]
+        for i in range(nx):
+            parent[i] = i
+
+        # Randomly join adjacent cells belonging to different sets
+        open_e = bytearray(nx)
+        coin = rng.random(nx).tolist()
+        for x in range(nx-1):
+            a = labels[x]
+            while parent[a] != a:
+                a = parent[a]
+            b = labels[x+1]
+            while parent[b] != b:
+                b = parent[b]
+            if a != b and (last_row or coin[x] < 0.5):
+                parent[b] = a
+                open_e[x] = 1
+        for x in range(nx):
+            a = labels[x]
+            while parent[a] != a:
+                a = parent[a]
+            labels[x] = a
+
+        # Carve at least one passage down from every set
+        open_s = bytearray(nx)
+        if not last_row:
+            coin = rng.random(2*nx).tolist()
+            has_down = bytearray(nx)
+            members = [0] * nx
+            pick = [0] * nx
+            for x in range(nx):
+                lab = labels[x]
+                if coin[x] < 0.5:
+                    open_s[x] = 1
+                    has_down[lab] = 1
+                # Reservoir sample one member of the set as a fallback
+                members[lab] += 1
+                if coin[nx+x] * members[lab] < 1:
+                    pick[lab] = x
+            for x in range(nx):
+                lab = labels[x]
+                if members[lab] and not has_down[lab]:
+                    open_s[pick[lab]] = 1
+                    has_down[lab] = 1
+            # Only the cells going down keep their set in the next row
+            for x in range(nx):
+                if not open_s[x]:
+                    labels[x] = -1
+
+        yield (np.frombuffer(open_s, dtype=np.uint8).astype(bool),
+               np.frombuffer(open_e, dtype=np.uint8).astype(bool))
+
+def carve_eller(nx, ny, rng, start=(0, 0)):
+    """Eller's algorithm, carving the maze one row at a time."""
+
+    open_s = np.zeros((ny, nx), dtype=bool)
+    open_e = np.zeros((ny, nx), dtype=bool)
+    for y, (row_s, row_e) in enumerate(eller_rows(nx, ny, rng)):
+        open_s[y] = row_s
+        open_e[y] = row_e
+    return open_s, open_e
+
+def carve_binary_tree(nx, ny, rng, start=(0, 0)):
+    """Binary tree algorithm: every cell links north or east at random."""
+
+    cols = np.arange(nx)
+    rows = np.arange(ny).reshape(-1, 1)
+    north = rng.random((ny, nx)) < 0.5
+    # Top row can only go east, east column can only go north
+    north = (north | (cols == nx-1)) & (rows > 0)
+    east = ~north & (cols < nx-1)
+    open_s = np.zeros((ny, nx), dtype=bool)
+    open_s[:-1] = north[1:]
+    return open_s, east
+
+def carve_sidewinder(nx, ny, rng, start=(0, 0)):
+    """Sidewinder algorithm: runs of east passages, each closed by one link north."""
+
+    cols = np.arange(nx)
+    # Close the current run at random, and always at the east border
+    close = (rng.random((ny, nx)) < 0.5) | (cols == nx-1)
+    # Top row is a single run going east
+    close[0] = cols == nx-1
+    open_e = ~close
+    open_s = np.zeros((ny, nx), dtype=bool)
+    if ny > 1:
+        # Runs never cross a row as the last cell of each row closes its run
+        ends = np.flatnonzero(close[1:])
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        picks = starts + (rng.random(ends.size) * (ends - starts + 1)).astype(np.int64)
+        # Link north from the picked cell, i.e. open the south wall above it
+        open_s.ravel()[picks] = True
+    return open_s, open_e
+
+# Batched versions of the row-local algorithms: B mazes carved at once into
+# (B, ny, nx) passage arrays, every decision vectorized across the batch.
+
+def carve_binary_tree_batch(B, nx, ny, rng):
+    """Binary tree algorithm on a batch of B mazes."""
+
+    cols = np.arange(nx)
+    rows = np.arange(ny).reshape(-1, 1)
+    north = rng.random((B, ny, nx)) < 0.5
+    north = (north | (cols == nx-1)) & (rows > 0)
+    east = ~north & (cols < nx-1)
+    open_s = np.zeros((B, ny, nx), dtype=bool)
+    open_s[:, :-1] = north[:, 1:]
+    return open_s, east
+
+def carve_sidewinder_batch(B, nx, ny, rng):
+    """Sidewinder algorithm on a batch of B mazes."""
+
+    cols = np.arange(nx)
+    close = (rng.random((B, ny, nx)) < 0.5) | (cols == nx-1)
+    close[:, 0] = cols == nx-1
+    open_e = ~close
+    open_s = np.zeros((B, ny, nx), dtype=bool)
+    if ny > 1:
+        # Runs end on the last cell of every row, so they never cross a row
+        # nor a maze of the batch
+        ends = np.flatnonzero(close[:, 1:])
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        picks = starts + (rng.random(ends.size) * (ends - starts + 1)).astype(np.int64)
+        north = np.zeros((B, ny-1, nx), dtype=bool)
+        north.ravel()[picks] = True
+        open_s[:, :-1] = north
+    return open_s, open_e
+
+def carve_eller_batch(B, nx, ny, rng):
+    """Eller's algorithm on a batch of B mazes, one row of every maze at a time.
+
+    Every set of a row is named after its leftmost cell, so the sets of the
+    whole batch are numbered b*nx + label and their reductions (any passage
+    down, random pick) are single bincount / ufunc.at calls.
+
+    """
+    open_s = np.zeros((B, ny, nx), dtype=bool)
+    open_e = np.zeros((B, ny, nx), dtype=bool)
+    cols = np.broadcast_to(np.arange(nx), (B, nx))
+    base = (np.arange(B) * nx).reshape(-1, 1)
+    labels = cols.copy()
+    for y in range(ny):
+        last_row = (y == ny-1)
+        # Randomly join adjacent cells belonging to different sets, every
+        # set of the last row
+        join = rng.random((B, nx-1)) < 0.5
+        for x in range(nx-1):
+            left, right = labels[:, x:x+1], labels[:, x+1:x+2]
+            merge = (left != right) & (join[:, x:x+1] | last_row)
+            open_e[:, y, x] = merge[:, 0]
+            joined = merge & ((labels == left) | (labels == right))
+            labels = np.where(joined, np.minimum(left, right), labels)
+        if last_row:
+            break
+
+        # Carve down at random, and from the cell with the largest key of
+        # every set without a passage down
+        down = rng.random((B, nx)) < 0.5
+        key = rng.random((B, nx))
+        sets = (base + labels).ravel()
+        set_down = np.bincount(sets, weights=down.ravel(), minlength=B*nx)[sets] > 0
+        set_max = np.full(B*nx, -1.0)
+        np.maximum.at(set_max, sets, key.ravel())
+        down |= (~set_down & (key.ravel() == set_max[sets])).reshape(B, nx)
+        open_s[:, y] = down
+        # Cells below a passage stay in their set, named after its leftmost
+        # passage down, the others start their own set
+        first = np.full(B*nx, nx)
+        np.minimum.at(first, sets[down.ravel()], cols[down])
+        labels = np.where(down, first[sets].reshape(B, nx), cols)
+    return open_s, open_e
+
+# Carving algorithms selectable with Maze(dim, algorithm=...)
+ALGORITHMS = {
+    'dfs': carve_dfs,
+    'kruskal': carve_kruskal,
+    'prim': carve_prim,
+    'wilson': carve_wilson,
+    'eller': carve_eller,
+    'binary_tree': carve_binary_tree,
+    'sidewinder': carve_sidewinder,
+}
+
+# Batched carving algorithms, for lib/batch.py
+BATCH_ALGORITHMS = {
+    'binary_tree': carve_binary_tree_batch,
+    'sidewinder': carve_sidewinder_batch,
+    'eller': carve_eller_batch,
+}
@@ -0,0 +1,150 @@
+import json
+import re
+from datetime import datetime
+from os import listdir
+from os.path import join, isdir, isfile, getsize
+
+from lib import maze_io
+# Catalog of the generated mazes of a results folder.
+#
+# Every result folder written by gridMazeGen.save_results gets one row in a
+# SQLite database ({results_dir}/.catalog.sqlite) with its size, seed,
+# algorithm, rewards, generation date and files. The rows are indexed by
+# folder, size and date, so looking mazes up never lists the results folder.
+
+CATALOG_FILE = '.catalog.sqlite'
+
+# Result folders are named {yymmdd}_{nx}X{ny}_{idx}
+FOLDER_PATTERN = re.compile(r'^(\d{6})_(\d+)X(\d+)_(\d+)$')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS mazes (
+    folder TEXT PRIMARY KEY,
+    nx INTEGER NOT NULL,
+    ny INTEGER NOT NULL,
+    seed TEXT,
+    algorithm TEXT,
+    r_default REAL,
+    r_wall REAL,
+    date TEXT NOT NULL,
+    files TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mazes_size ON mazes (nx, ny);
+CREATE INDEX IF NOT EXISTS mazes_date ON mazes (date);
+'''
+
+def folder_files(target_dir):
+    """Return {file name: size in bytes} of the files of a result folder."""
+
+    return {file: getsize(join(target_dir, file)) for file in sorted(listdir(target_dir))
+            if isfile(join(target_dir, file))}
+
+class MazeCatalog:
+    def __init__(self, results_dir):
+        # sqlite3 is only loaded by the processes opening a catalog
+        import sqlite3
+        self.results_dir = results_dir
+        self.db_file = join(results_dir, CATALOG_FILE)
+        new = not isfile(self.db_file)
+        self.db = sqlite3.connect(self.db_file)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        if new:
+            # Catalog the result folders written before the catalog existed
+            self.rebuild()
+
+    def close(self):
+        self.db.close()
+
+    def add(self, entries):
+        """Add (or replace) the catalog rows of a list of result folders.
+
+        Each entry is a dict with folder, nx, ny, seed, algorithm, r_default,
+        r_wall, date (datetime) and files ({file name: size}).
+
+        """
+        rows = [(e['folder'], e['nx'], e['ny'], json.dumps(maze_io.json_seed(e.get('seed'))),
+                 e.get('algorithm'), e.get('r_default'), e.get('r_wall'),
+                 e['date'].strftime('%Y-%m-%d %H:%M:%S'), json.dumps(e['files']))
+                for e in entries]
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO mazes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def rebuild(self, folders=None):
+        """Catalog every result folder found in the results folder, or the given ones.
+
+        Only the size and date encoded in the folder name are known for them.
+
+        """
+        entries = []
+        for folder in sorted(listdir(self.results_dir) if folders is None else folders):
+            match = FOLDER_PATTERN.match(folder)
+            if match is None or not isdir(join(self.results_dir, folder)):
+                continue
+            date, nx, ny, _ = match.groups()
+            entries.append({'folder': folder, 'nx': int(nx), 'ny': int(ny),
+                            'date': datetime.strptime(date, '%y%m%d'),
+                            'files': folder_files(join(self.results_dir, folder))})
+        self.add(entries)
+
+    def sync(self):
+        """Match the catalog to the result folders of the results folder.
+
+        Folders saved without the catalog are cataloged from their names,
+        folders deleted from the results folder are dropped. Only the results
+        folder is listed, and nothing changes when the folder names match.
+
+        """
+        names = {folder for folder in listdir(self.results_dir) if FOLDER_PATTERN.match(folder)}
+        cataloged = set(self.folders())
+        if names == cataloged:
+            return
+        with self.db:
+            self.db.executemany('DELETE FROM mazes WHERE folder = ?', [(folder,) for folder in cataloged - names])
+        self.rebuild(names - cataloged)
+
+    def query(self, nx=None, ny=None, date_from=None, date_to=None):
+        """Return the catalog rows matching a maze size and/or a date range.
+
+        Dates are datetimes or 'YYYY-MM-DD[ HH:MM:SS]' strings, date_to is
+        inclusive. Rows are dicts, ordered by folder name, with their files
+        decoded to {file name: size}.
+
+        """
+        where, args = [], []
+        if nx is not None:
+            where.append('nx = ?')
+            args.append(nx)
+        if ny is not None:
+            where.append('ny = ?')
+            args.append(ny)
+        if date_from is not None:
+            where.append('date >= ?')
+            args.append(str(date_from))
+        if date_to is not None:
+            # Make a bare date include the whole day
+            where.append('date <= ?')
+            args.append(str(date_to) + ('' if len(str(date_to)) > 10 else ' 23:59:59'))
+        sql = 'SELECT * FROM mazes'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY folder'
+        return [self.decode(row) for row in self.db.execute(sql, args)]
+
+    def get(self, folder):
+        """Return the catalog row of a result folder, or None."""
+
+        row = self.db.execute('SELECT * FROM mazes WHERE folder = ?', (folder,)).fetchone()
+        return None if row is None else self.decode(row)
+
+    def folders(self):
+        """Return the cataloged result folders, sorted by name."""
+
+        return [row[0] for row in self.db.execute('SELECT folder FROM mazes ORDER BY folder')]
+
+    @staticmethod
+    def decode(row):
+        entry = dict(row)
+        entry['seed'] = json.loads(entry['seed'])
+        entry['files'] = json.loads(entry['files'])
+        return entry
@@ -1,14 +1,251 @@
-from datetime import datetime
-from rig.type_casts import float_to_fp, fp_to_float, NumpyFloatToFixConverter, NumpyFixToFloatConverter
-from os import getcwd, mkdir, listdir
-from os.path import join, isdir, splitext
-from IPython.display import display, HTML
-from base64 import b64encode
+import json
+from os import getcwd, mkdir, makedirs, listdir, link, rename
+from os.path import join, isdir, isfile, splitext, basename, getsize
+
+import numpy as np
+
+from lib import map_gen as mg
+from lib import maze_io
+from lib import mem_export
+from lib.goals import GoalIndex
+from lib.analytics import MazeAnalytics
+from lib.catalog import MazeCatalog, CATALOG_FILE
+from lib.instrument import Instrument, PrintSink, JsonlSink, ProgressSink, SUMMARY
+from lib.support import pool_map
+
+def load_config(fname):
+    """Return (header, NS, RT) of a text or binary (.mzb) maze config file."""
+
+    if splitext(fname)[1] == maze_io.CONFIG_EXT:
+        return maze_io.read_config_bin(fname)
+    return maze_io.read_config_txt(fname)
+
+def export_suffix(radix=10, formats=('coe',), pack_ns=False, bram=None):
+    # Folder name suffix of the export options changing the memory files,
+    # none for the original options
+    suffix = ''
+    if pack_ns:
+        suffix += '_packed'
+    if radix != 10 and 'coe' in formats:
+        suffix += f'_r{radix}'
+    if tuple(formats) != ('coe',):
+        suffix += '_' + '-'.join(sorted(set(formats)))
+    if bram is not None:
+        suffix += f'_B{bram[0]}x{bram[1]}'
+    return suffix
+
+def coe_folder(N, goal, dat_width, frac_bit, rounding='trunc', overflow='wrap', encoding='full', bram=None,
+               pack_ns=False, radix=10, formats=('coe',)):
+    # Name of a COE set folder, with every option changing its files. The
+    # original conversion keeps the original name
+    name = f'COE_S{N}G{goal}_Q{dat_width}-{frac_bit}'
+    if rounding != 'trunc':
+        name += f'_{rounding}'
+    if overflow != 'wrap':
+        name += f'_{overflow}'
+    if encoding != 'full':
+        name += f'_{encoding}'
+    return name + export_suffix(radix, formats, pack_ns and encoding == 'full', bram)
+
+def ns_folder(N, export):
+    # Shared NS memories of the COE sets of a maze, one folder per export options
+    return f'COE_S{N}_NS' + export_suffix(export['radix'], export['formats'], export['pack_ns'], export['bram'])
+
+# Encodings of the memories of a COE set:
+# - 'full': Z NS memories of next state numbers (or one with pack_ns) and an
+#   RT memory of N*Z reward words
+# - 'compact': a cell memory of one word per state, its Z wall bits and the
+#   Z codes of its rewards in a reward lookup table, see compact_cells
+ENCODINGS = ('full', 'compact')
+
+def check_encoding(encoding, bram=None):
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding '{encoding}'. Choose from {', '.join(ENCODINGS)}.")
+    if bram is not None and (len(bram) != 2 or min(bram) < 1):
+        raise ValueError(f'bram must be a (depth, width) pair of positive sizes, not {bram}')
+
+def write_mem(coe_dir, name, words, width, formats=('coe',), radix=10, bram=None):
+    """Write a memory in coe_dir, split in banks when bram=(depth, width) is given, return the file names."""
+
+    prefix = join(coe_dir, name)
+    if bram is None:
+        fnames = mem_export.write_memory(prefix, words, width, formats, radix)
+    else:
+        fnames = mem_export.write_banks(prefix, words, width, bram, formats, radix)
+    return [basename(fname) for fname in fnames]
+
+def grid_steps(nx, Z):
+    # State number offset of each action of the Z actions model
+    if Z not in mg.ACTION_MODELS:
+        raise ValueError(f'No action model of {Z} actions')
+    return np.array([dx + nx*dy for dx, dy in (mg.ACTION_STEPS[action] for action in mg.ACTION_MODELS[Z])],
+                    dtype=np.int64)
+
+def compact_cells(NS, rt_words, nx):
+    """Return (words, width, lut, code_bits) of the compact encoding of a maze.
+
+    rt_words are the quantized (N, Z) rewards. The word of a state holds a
+    wall bit per action in bits 0 to Z-1 (set when the action is blocked,
+    the next state being the state itself) then, from bit Z, the code_bits
+    bits index of the reward of each action in lut, the distinct reward
+    words. The next states are recovered from the state number, nx and the
+    wall bits, see decode_compact.
+
+    """
+    NS = np.asarray(NS, dtype=np.int64)
+    N, Z = NS.shape
+    states = np.arange(N, dtype=np.int64).reshape(-1, 1)
+    blocked = NS == states
+    if not (blocked | (NS == states + grid_steps(nx, Z))).all():
+        raise ValueError(f'The next states are not the moves of a {nx} cells wide grid maze, '
+                         'use the full encoding')
+    lut, codes = np.unique(np.asarray(rt_words, dtype=np.uint64).reshape(N, Z), return_inverse=True)
+    code_bits = mem_export.addr_width(len(lut))
+    width = Z * (1 + code_bits)
+    if width > 64:
+        raise ValueError(f'{len(lut)} distinct rewards do not fit in a 64 bits cell word, use the full encoding')
+    words = mem_export.pack_fields(blocked, 1) | (mem_export.pack_fields(codes.reshape(N, Z), code_bits) << np.uint64(Z))
+    return words, width, lut, code_bits
+
+def decode_compact(words, lut, nx, Z, code_bits):
+    """Return the (NS, RT words) of the cell words of compact_cells, as the RTL decodes them."""
+
+    words = np.asarray(words, dtype=np.uint64).reshape(-1, 1)
+    states = np.arange(len(words), dtype=np.int64).reshape(-1, 1)
+    actions = np.arange(Z, dtype=np.uint64)
+    blocked = (words >> actions) & np.uint64(1)
+    codes = (words >> (np.uint64(Z) + actions*np.uint64(code_bits))) & np.uint64((1 << code_bits) - 1)
+    return np.where(blocked == 1, states, states + grid_steps(nx, Z)), np.asarray(lut)[codes.astype(np.int64)]
+
+def write_compact_mem(coe_dir, NS, rt_words, nx, dat_width, frac_bit, formats=('coe',), radix=10, bram=None):
+    """Write the compact memories of a maze in coe_dir, return their file names.
+
+    S{N}_CELL_MEM holds the cell words (split in banks when bram is given)
+    and S{N}_RT_LUT the reward lookup table. S{N}_LAYOUT.json describes the
+    fields, steps and banks for the RTL.
+
+    """
+    N, Z = np.shape(NS)
+    words, width, lut, code_bits = compact_cells(NS, rt_words, nx)
+    filenames = write_mem(coe_dir, f'S{N}_CELL_MEM', words, width, formats, radix, bram)
+    # The table is a few words, never banked
+    filenames += write_mem(coe_dir, f'S{N}_RT_LUT', lut, dat_width, formats, radix)
+    layout = {'encoding': 'compact', 'N': N, 'nx': nx, 'Z': Z, 'steps': grid_steps(nx, Z).tolist(),
+              'cell_width': width, 'wall_bits': [0, Z], 'code_bits': code_bits, 'lut': lut.tolist(),
+              'lut_values': mem_export.dequantize(lut, dat_width, frac_bit).tolist(),
+              'dat_width': dat_width, 'frac_bit': frac_bit,
+              'bram': None if bram is None else {'depth': bram[0], 'width': bram[1], 'rows': -(-N // bram[0]),
+                                                 'cols': -(-width // bram[1])}}
+    with open(join(coe_dir, f'S{N}_LAYOUT.json'), 'w') as f:
+        json.dump(layout, f, indent=1)
+    return filenames + [f'S{N}_LAYOUT.json']
+
+def memory_bits(N, Z, dat_width, encoding='full', lut_size=0, code_bits=0):
+    # On-chip bits of the memories of a COE set
+    if encoding == 'compact':
+        return N * Z * (1 + code_bits) + lut_size * dat_width
+    return N * Z * (mem_export.addr_width(N) + dat_width)
+
+def write_ns_mem(coe_dir, NS, formats=('coe',), radix=10, pack_ns=False, bram=None):
+    """Write the NS memories of a maze in coe_dir, return their file names.
+
+    Each action gets its own memory (S{N}_NS{a}_MEM), or with pack_ns a
+    single memory (S{N}_NS_MEM) holds the Z next states of a state in one
+    word, action 0 in the low bits. With bram=(depth, width) every memory
+    is split in banks, see mem_export.bank_words.
+
+    """
+    N, Z = NS.shape
+    width = mem_export.addr_width(N)
+    if pack_ns:
+        memories = [(f'S{N}_NS_MEM', mem_export.pack_fields(NS, width), Z*width)]
+    else:
+        memories = [(f'S{N}_NS{a}_MEM', NS[:, a], width) for a in range(Z)]
+    filenames = []
+    for name, words, mem_width in memories:
+        filenames += write_mem(coe_dir, name, words, mem_width, formats, radix, bram)
+    return filenames
+
+def link_file(src, dst):
+    # Share the file when the file system supports hard links
+    try:
+        link(src, dst)
+    except OSError:
+        from shutil import copyfile
+        copyfile(src, dst)
+
+def coe_ns_job(job):
+    """Write the goal independent NS memories of a maze in its ns_folder, unless written before.
+
+    Returns (N, NS file names).
+
+    """
+    config_file, target_dir, export = job
+    _, NS, _ = load_config(config_file)
+    N = NS.shape[0]
+    if export['encoding'] == 'compact':
+        # The next states are in the cell words of each COE set
+        return N, []
+    ns_dir = join(target_dir, ns_folder(N, export))
+    if isdir(ns_dir):
+        # Written by a previous run with the same options, and linked into
+        # its COE sets: keep it
+        return N, sorted(listdir(ns_dir))
+    # Written aside then renamed, a folder is always complete
+    from shutil import rmtree
+    tmp_dir = ns_dir + '.tmp'
+    rmtree(tmp_dir, ignore_errors=True)
+    makedirs(tmp_dir)
+    filenames = write_ns_mem(tmp_dir, NS, export['formats'], export['radix'], export['pack_ns'], export['bram'])
+    rename(tmp_dir, ns_dir)
+    return N, filenames
+
+def coe_goal_job(job):
+    """Write the COE sets of some goals of a maze in every Q format, return their folders."""
+
+    config_file, target_dir, goals, q_formats, goal_reward, ns_names, export = job
+    header, NS, RT = load_config(config_file)
+    N = NS.shape[0]
+    ns_dir = join(target_dir, ns_folder(N, export))
+    index = GoalIndex(NS)
+    coe_dirs = []
+    for dat_width, frac_bit in q_formats:
+        # Quantize the rewards once per Q format, each goal only changes the
+        # few entries moving into it
+        base = mem_export.quantize(RT, dat_width, frac_bit, export['rounding'], export['overflow']).ravel()
+        goal_word = mem_export.quantize(goal_reward, dat_width, frac_bit, export['rounding'], export['overflow'])
+        for goal in goals:
+            coe_dir = join(target_dir, coe_folder(N, goal, dat_width, frac_bit, export['rounding'], export['overflow'],
+                                                  export['encoding'], export['bram'], export['pack_ns'],
+                                                  export['radix'], export['formats']))
+            if isdir(coe_dir):
+                # Like gen_COE, never overwrite an existing COE set
+                continue
+            mkdir(coe_dir)
+            for filename in ns_names:
+                link_file(join(ns_dir, filename), join(coe_dir, filename))
+            words = base.copy()
+            words[index.incoming(goal)] = goal_word
+            if export['encoding'] == 'compact':
+                write_compact_mem(coe_dir, NS, words, header['nx'], dat_width, frac_bit, export['formats'],
+                                  export['radix'], export['bram'])
+            else:
+                write_mem(coe_dir, f'S{N}_RT_MEM', words, dat_width, export['formats'], export['radix'], export['bram'])
+            coe_dirs.append(coe_dir)
+    return coe_dirs
 
 class COEgen:
-    def __init__(self, target_folder_name):
+    def __init__(self, target_folder_name, config_format='txt', verbose=2, sinks=None):
+        # Messages (verbose 0: none, 1: stage summaries, 2: everything), stage
+        # timings and progress, see lib/instrument.py. Prompts always print.
+        self.instrument = Instrument(verbose, sinks)
         self.current_dir = getcwd()
         self.results_folder_name = target_folder_name
+        self.catalog = None
+        # Maze config files to load: 'txt' or 'bin' (.mzb)
+        if config_format not in ('txt', 'bin'):
+            raise ValueError(f"Unknown config format '{config_format}'. Choose from txt, bin.")
+        self.config_ext = '.txt' if config_format == 'txt' else maze_io.CONFIG_EXT
 
     def gen_path(self, c_dir, subdir_name):
         # Create path to sub directory
@@ -16,18 +253,18 @@ class COEgen:
 
         # Check if subdirectory exist. If doesn't exist generate new one.
         if isdir(subdir_path)==False:
-            print("Folder '%s' does not exist. " % subdir_name, end = "")
             mkdir(subdir_path)
-            print("Created a new folder named '%s'."% subdir_name)
+            self.instrument.log("Folder '%s' does not exist. Created a new folder named '%s'." % (subdir_name, subdir_name))
         else:
-            print("Folder named '%s' exist." % subdir_name)
+            self.instrument.log("Folder named '%s' exist." % subdir_name)
             
         # Return geneated path    
         return subdir_path
     
     def scan_file(self, dir, quiet=False):
-        # Get list of maze config available in the folder
-        list_files = listdir(dir)
+        # Get list of maze config available in the folder, hidden entries
+        # (like the maze cache) excluded
+        list_files = [file for file in listdir(dir) if not file.startswith('.')]
 
         # Sort file
         list_files.sort()
@@ -41,15 +278,48 @@ class COEgen:
 
         # Print all files
         if not quiet:
-            print("%d maze confing file(s) detected."% len(list_files))
-            for file in list_files:
-                idx = list_files.index(file) + 1
-                print("%d) %s"% (idx, file))
+            self.print_files(list_files)
         
         return list_files
+
+    def print_files(self, list_files):
+        print("%d maze confing file(s) detected."% len(list_files))
+        print(''.join(["%d) %s\n"% (idx, file) for idx, file in enumerate(list_files, 1)]), end='')
+
+    def open_catalog(self, results_dir):
+        # Use the catalog of the results folder when gridMazeGen wrote one
+        if isfile(join(results_dir, CATALOG_FILE)):
+            catalog = MazeCatalog(results_dir)
+            # Folders saved without the catalog, or deleted since
+            catalog.sync()
+            return catalog
+        return None
+
+    def query(self, nx=None, ny=None, date_from=None, date_to=None):
+        """Return the cataloged mazes of the results folder matching a size and/or date range."""
+
+        catalog = MazeCatalog(join(self.current_dir, self.results_folder_name))
+        catalog.sync()
+        rows = catalog.query(nx, ny, date_from, date_to)
+        catalog.close()
+        return rows
+
+    def folder_files(self, target_dir):
+        # Files of a result folder, from the catalog when it is cataloged
+        row = self.catalog.get(basename(target_dir)) if self.catalog else None
+        if row is None:
+            return self.scan_file(target_dir, quiet=True)
+        return sorted(row['files'])
+
+    def config_files(self, target_dir):
+        # Maze config files of a result folder
+        return [file for file in self.folder_files(target_dir) if splitext(file)[1] == self.config_ext]
     
-    def select_file(self, dir):
-        file_list = self.scan_file(dir)
+    def select_file(self, dir, file_list=None):
+        if file_list is None:
+            file_list = self.scan_file(dir)
+        else:
+            self.print_files(file_list)
         # Get user input to select overlay from overlay file list
         loop = True
         while(loop):
@@ -64,22 +334,18 @@ class COEgen:
     
     def choose_config(self):
         results_dir = self.gen_path(self.current_dir, self.results_folder_name)
-        target_file = self.select_file(results_dir)
+        self.catalog = self.open_catalog(results_dir)
+        folders = self.catalog.folders() if self.catalog else None
+        target_file = self.select_file(results_dir, folders)
         target_dir = self.gen_path(results_dir, target_file)
         
-        list_of_file = self.scan_file(target_dir)
-
-        # Filter to only bitstream files
-        config_file_list = []
-        for file in list_of_file:
-            extension = splitext(file)[1]
-            if (extension == ".txt"):
-                config_file_list.append(file)
+        # Filter to only maze config files
+        config_file_list = self.config_files(target_dir)
         
         if (len(config_file_list)!=1):
-            print(f'Mutliple .txt files detected. Selected {config_file_list[0]}')
+            self.instrument.log(f'Mutliple {self.config_ext} files detected. Selected {config_file_list[0]}')
         else:
-            print(f'Selected {config_file_list[0]}')
+            self.instrument.log(f'Selected {config_file_list[0]}')
         config_file = config_file_list[0]
 
         self.target_dir = target_dir
@@ -88,22 +354,30 @@ class COEgen:
     def load_mazeConfig(self):
         # Read Maze config file
         config_target = join(self.target_dir, self.config_file)
+        with self.instrument.stage('load_config', bytes=getsize(config_target)) as counters:
+            if splitext(self.config_file)[1] == maze_io.CONFIG_EXT:
+                self.load_mazeConfig_bin(config_target)
+            else:
+                self.load_mazeConfig_txt(config_target)
+            counters['states'] = self.N
+
+    def load_mazeConfig_txt(self, config_target):
         with open(config_target, 'r') as f:
-            print(f'Loading {self.config_file}...')
+            self.instrument.log(f'Loading {self.config_file}...')
             lines = f.readlines()
             total_line = len(lines)
-            print(f'\tFile consists of {total_line} lines of data.')
+            self.instrument.log(f'\tFile consists of {total_line} lines of data.')
             f.close()
         
         # Load Maze Size
         maze_x = int(lines[0])
         maze_y = int(lines[1])
         total_state = maze_x * maze_y
-        print(f'\tMaze size loaded. {maze_x}X{maze_y} ({total_state} states)')
+        self.instrument.log(f'\tMaze size loaded. {maze_x}X{maze_y} ({total_state} states)')
 
         # Load total action
         total_act = int(lines[2])
-        print(f'\tNumber of action loaded. There are {total_act} actions')
+        self.instrument.log(f'\tNumber of action loaded. There are {total_act} actions')
 
         # Load Next State list
         NS_list = [[0] * total_act for i in range(total_state)]
@@ -112,7 +386,7 @@ class COEgen:
             x.remove('\n')
             for j in range(total_act):
                 NS_list[i][j] = int(x[j])
-        print('\tNext State list loaded.')
+        self.instrument.log('\tNext State list loaded.')
 
         # Load Current Reward List
         RT_list = [[0.0] * total_act for i in range(total_state)]
@@ -121,14 +395,72 @@ class COEgen:
             x.remove('\n')
             for j in range(total_act):
                 RT_list[i][j] = float(x[j])
-        print('\tCurrent Reward list loaded.')
-        print(f'Finish loading {self.config_file}')
+        self.instrument.log('\tCurrent Reward list loaded.')
+        self.instrument.log(f'Finish loading {self.config_file}')
 
+        self.nx = maze_x
         self.N = total_state
         self.Z = total_act
         self.NS = NS_list
         self.RT = RT_list
+        # Rewards without goal, the goals are applied on a copy
+        self.base_RT = RT_list
+        self.goal_index = None
     
+    def load_mazeConfig_bin(self, config_target):
+        # Map the matrices of a binary config file, nothing is parsed or copied
+        self.instrument.log(f'Loading {self.config_file}...')
+        header, NS, RT = maze_io.read_config_bin(config_target)
+        self.instrument.log(f"\tMaze size loaded. {header['nx']}X{header['ny']} ({NS.shape[0]} states)")
+        self.instrument.log(f"\tNumber of action loaded. There are {header['Z']} actions")
+        self.instrument.log(f'Finish loading {self.config_file}')
+
+        self.config_header = header
+        self.nx = header['nx']
+        self.N = NS.shape[0]
+        self.Z = NS.shape[1]
+        self.NS = NS
+        self.RT = RT
+        self.base_RT = RT
+        self.goal_index = None
+
+    def load_mazePack(self, pack_dir, maze_id):
+        """Load maze maze_id of a dataset pack (see lib/pack.py), reading its record only.
+
+        pack_dir is relative to the results folder. The COE sets and
+        analytics of the maze go in {pack_dir}/maze_{maze_id}.
+
+        """
+        from lib.pack import PackReader, decode_record
+        pack_dir = join(self.current_dir, self.results_folder_name, pack_dir)
+        with self.instrument.stage('load_config', bytes=0) as counters:
+            with PackReader(pack_dir) as reader:
+                record = reader.record(maze_id)
+                self.instrument.log(f'Loading maze {maze_id} of {basename(pack_dir)}...')
+                header, NS, RT, _ = decode_record(record, reader.codec)
+            self.instrument.log(f"\tMaze size loaded. {header['nx']}X{header['ny']} ({NS.shape[0]} states)")
+            self.instrument.log(f"\tNumber of action loaded. There are {header['Z']} actions")
+            counters['bytes'] = len(record)
+            counters['states'] = NS.shape[0]
+
+        self.target_dir = join(pack_dir, f'maze_{maze_id}')
+        makedirs(self.target_dir, exist_ok=True)
+        self.config_file = f'maze_{maze_id}'
+        self.config_header = header
+        self.nx = header['nx']
+        self.N = NS.shape[0]
+        self.Z = NS.shape[1]
+        self.NS = NS
+        self.RT = RT
+        self.base_RT = RT
+        self.goal_index = None
+
+    def analytics(self):
+        """Return the MazeAnalytics of the loaded maze, cached in a folder next to its config file."""
+
+        cache_dir = join(self.target_dir, splitext(self.config_file)[0] + '_analytics')
+        return MazeAnalytics(self.NS, cache_dir)
+
     def print_NS(self):
         print('NEXT STATE MEMORY')
         for i in range(self.N):
@@ -152,76 +484,263 @@ class COEgen:
             print()
 
     def add_goal_state(self, width, goal_reward=10):
+        # Notebook only: the headless paths don't need IPython
+        from base64 import b64encode
+        from IPython.display import display, HTML
+
         # Display SVG
         print(f"Selected Maze Map")
-        ## Scan for SVG image in config folder
-        list_of_file = self.scan_file(self.target_dir, quiet=True)
+        ## Scan for SVG image in config folder, or PNG when there is no SVG
+        list_of_file = self.folder_files(self.target_dir)
         SVG_file = []
+        PNG_file = []
         for file in list_of_file:
             fname = splitext(file)
             if (fname[1] == ".svg"):
                 SVG_file.append(file)
-        ## Select and load SVG file into HTML
-        svg_file = join(self.target_dir, SVG_file[1])
-        with open(svg_file, "rb") as image_file:
-            svg_base64 = str(b64encode(image_file.read()),'utf-8')
-        html_template = f'<img src="data:image/svg+xml;base64,{svg_base64}" width="{width}"/>'
+            elif (fname[1] == ".png"):
+                PNG_file.append(file)
+        ## Select and load image file into HTML
+        if SVG_file:
+            img_file, mime = join(self.target_dir, SVG_file[-1]), 'image/svg+xml'
+        else:
+            img_file, mime = join(self.target_dir, PNG_file[0]), 'image/png'
+        with open(img_file, "rb") as image_file:
+            img_base64 = str(b64encode(image_file.read()),'utf-8')
+        html_template = f'<img src="data:{mime};base64,{img_base64}" width="{width}"/>'
         display(HTML(html_template))
 
         # Ask user for the goal_state
         N_ = self.N-1
         loop = True
         while(loop):
-            self.goal_state = int(input(f'Goal State (0-{N_}): '))
-            if (self.goal_state > (N_)):
+            try:
+                goal_state = int(input(f'Goal State (0-{N_}): '))
+            except ValueError:
+                print("Goal State must be a number. Try again")
+                continue
+            if not (0 <= goal_state <= N_):
                 print("Goal State out of bounds. Try again")
             else:
                 loop = False
-                print(f"Maze Goal is S{self.goal_state:03d}")
+                print(f"Maze Goal is S{goal_state:03d}")
 
         # Updates Current Reward list
-        for i in range(self.N):
-            for j in range(self.Z):
-                if (self.NS[i][j]==self.goal_state)&(i != self.goal_state):
-                    self.RT[i][j] = goal_reward
-        print('Current Reward list updated.')
+        self.set_goals(goal_state, goal_reward)
+        self.instrument.log('Current Reward list updated.')
+
+    def set_goals(self, goals, goal_reward=10):
+        """Set the rewards of one or many goal states, replacing the previous goals.
+
+        goal_reward is a single reward or one reward per goal. self.RT becomes
+        a new array, the loaded rewards are kept untouched in self.base_RT.
+
+        """
+        if self.goal_index is None:
+            # Reverse transitions of the maze, built once per loaded config
+            self.goal_index = GoalIndex(self.NS)
+        goals = np.atleast_1d(goals).tolist()
+        if any(not 0 <= goal < self.N for goal in goals):
+            raise ValueError(f'Goal states must be in 0-{self.N-1}')
+        self.RT = self.goal_index.apply(self.base_RT, goals, goal_reward)
+        self.goals = goals
+        self.goal_rewards = np.broadcast_to(goal_reward, len(goals)).tolist()
+        # COE sets of many goals are named after all of them
+        self.goal_state = goals[0] if len(goals) == 1 else '-'.join(str(goal) for goal in goals)
     
-    def gen_COE(self, dat_width, frac_bit):
-        folder_name = f'COE_S{self.N}G{self.goal_state}_Q{dat_width}-{frac_bit}'
+    def apply_diff(self, diff):
+        """Apply the diff of a wall edit (see Maze.set_walls) to the loaded matrices.
+
+        Only the edited entries of NS and RT change, the goal rewards set by
+        set_goals follow the new transitions. Returns the (states, actions)
+        of the changed entries, for coe_patch.
+
+        """
+        states, actions = diff['state'].tolist(), diff['action'].tolist()
+        goals = dict(zip(getattr(self, 'goals', []), getattr(self, 'goal_rewards', [])))
+        for k, (s, a) in enumerate(zip(states, actions)):
+            ns = int(diff['ns'][k])
+            self.NS[s][a] = ns
+            if 'rt' in diff:
+                self.base_RT[s][a] = float(diff['rt'][k])
+            self.RT[s][a] = goals[ns] if ns in goals and ns != s else self.base_RT[s][a]
+        # Reverse transitions changed, built again by the next set_goals
+        self.goal_index = None
+        return np.array(states, dtype=np.int64), np.array(actions, dtype=np.int64)
+
+    def coe_patch(self, changed, dat_width, frac_bit, rounding='trunc', overflow='wrap', pack_ns=False,
+                  encoding='full', bram=None):
+        """Return the memory words of gen_COE changed by apply_diff.
+
+        changed is the (states, actions) returned by apply_diff. The patch is
+        a list of (memory, width, addresses, words), one per memory (or bank
+        with bram), for mem_export.write_patch. Compact COE sets can't be
+        patched: an edit can change their reward table, and so every cell.
+
+        """
+        check_encoding(encoding, bram)
+        if encoding == 'compact':
+            raise ValueError('Compact COE sets cannot be patched, generate them again with gen_COE')
+        states, actions = changed
+        patches = []
+        width = mem_export.addr_width(self.N)
+        if pack_ns:
+            rows = np.unique(states)
+            ns = np.array([self.NS[s] for s in rows.tolist()], dtype=np.int64).reshape(-1, self.Z)
+            patches.append((f'S{self.N}_NS_MEM', self.Z*width, rows, mem_export.pack_fields(ns, width)))
+        else:
+            for a in range(self.Z):
+                rows = states[actions == a]
+                patches.append((f'S{self.N}_NS{a}_MEM', width, rows,
+                                np.array([self.NS[s][a] for s in rows.tolist()], dtype=np.int64)))
+        rt = np.array([self.RT[s][a] for s, a in zip(states.tolist(), actions.tolist())])
+        patches.append((f'S{self.N}_RT_MEM', dat_width, states*self.Z + actions,
+                        mem_export.quantize(rt, dat_width, frac_bit, rounding, overflow)))
+        if bram is not None:
+            patches = [bank for patch in patches for bank in mem_export.bank_patch(*patch, bram)]
+        return patches
+
+    def gen_COE(self, dat_width, frac_bit, radix=10, formats=('coe',), rounding='trunc', overflow='wrap',
+                pack_ns=False, encoding='full', bram=None):
+        """Write the NS and RT memories of the maze and goal in a COE set folder.
+
+        The rewards are quantized to dat_width bits words with frac_bit
+        fraction bits (see mem_export.quantize for rounding and overflow)
+        and every memory is written in each of the formats ('coe', 'mif',
+        'hex', 'bin'), COE files in the given radix (2, 10 or 16). With
+        pack_ns the Z next states of a state share a single word. The
+        'compact' encoding writes a cell memory and a reward table instead
+        (see compact_cells), and bram=(depth, width) splits the memories in
+        banks of that BRAM shape.
+
+        """
+        check_encoding(encoding, bram)
+        folder_name = coe_folder(self.N, self.goal_state, dat_width, frac_bit, rounding, overflow, encoding, bram,
+                                 pack_ns, radix, formats)
         coe_dir = join(self.target_dir, folder_name)
 
         # Create the directory if it does not exist
         if isdir(coe_dir):
-            print("File '% s' already exist. NO COE FILES WILL BE GENERATED." % coe_dir)
-        else:
-            mkdir(coe_dir)
-            print("File '% s' created" % coe_dir)
-        
-            ## Generate Z COE files for NS_MEM
-            print(f"In {coe_dir}:")
-            for a in range(self.Z):
-                filename = f'S{self.N}_NS{a}_MEM.coe'
-                path = join(coe_dir, filename)
-                with open(path, 'w') as f:
-                    print('memory_initialization_radix=10;', file = f)
-                    print('memory_initialization_vector=',  end ='', file = f)
-                    for s in range(self.N):
-                        print(f' {self.NS[s][a]}',  end ='', file = f)
-                    print(';', file = f)
-                f.close()
-                print(f"\tGenerated {filename}")
-
-            ## Generate a single COE file for RT_MEM
-            filename = f'S{self.N}_RT_MEM.coe'
-            path = join(coe_dir, filename)
-            with open(path, 'w') as f:
-                print('memory_initialization_radix=10;', file = f)
-                print('memory_initialization_vector=',  end ='', file = f)
-                for s in range(self.N):
-                    for a in range(self.Z):
-                        val0 = self.RT[s][a]*(2**frac_bit)
-                        val1 = (int(val0) + (1 << dat_width)) % (1 << dat_width)
-                        print(f' {val1}',  end ='', file = f)
-                print(';', file = f)
-            f.close()
-            print(f"\tGenerated {filename}")
\ No newline at end of file
+            self.instrument.log("File '% s' already exist. NO COE FILES WILL BE GENERATED." % coe_dir, SUMMARY)
+            return
+        mkdir(coe_dir)
+        self.instrument.log("File '% s' created" % coe_dir)
+
+        with self.instrument.stage('gen_COE', states=self.N, bytes=0) as counters:
+            self.instrument.log(f"In {coe_dir}:")
+            words = mem_export.quantize(np.asarray(self.RT).ravel(), dat_width, frac_bit, rounding, overflow)
+            if encoding == 'compact':
+                ## Generate the cell memory and the reward table
+                filenames = write_compact_mem(coe_dir, self.NS, words, self.nx, dat_width, frac_bit, formats, radix,
+                                              bram)
+                lut_size = len(np.unique(words))
+                bits = memory_bits(self.N, self.Z, dat_width, encoding, lut_size, mem_export.addr_width(lut_size))
+                self.instrument.log(f"\t{bits} memory bits, {memory_bits(self.N, self.Z, dat_width)} with the full encoding")
+            else:
+                ## Generate the NS_MEM files, Z of them unless packed
+                filenames = write_ns_mem(coe_dir, np.asarray(self.NS), formats, radix, pack_ns, bram)
+
+                ## Generate a single RT_MEM file per format
+                filenames += write_mem(coe_dir, f'S{self.N}_RT_MEM', words, dat_width, formats, radix, bram)
+            for filename in filenames:
+                self.instrument.log(f"\tGenerated {filename}")
+                counters['bytes'] += getsize(join(coe_dir, filename))
+
+    def gen_COE_batch(self, mazes, goals, q_formats, goal_reward=10, workers=1, radix=10, formats=('coe',),
+                      rounding='trunc', overflow='wrap', pack_ns=False, encoding='full', bram=None):
+        """Generate the COE sets of several mazes, goals and Q formats, without any prompt.
+
+        mazes is a list of result folder names or 'all', goals a list of goal
+        states or 'all' (every state of each maze) and q_formats a list of
+        (dat_width, frac_bit). Each COE set is written like gen_COE (with the
+        same export options), the goal rewards applied to a fresh copy of the
+        maze RT. The NS files don't depend on the goal: they are written once
+        per maze in COE_S{N}_NS and hard linked into every COE set (compact
+        COE sets hold them in their cell words). Existing COE sets are left
+        untouched. Returns the list of generated COE
+        folders.
+
+        """
+        results_dir = join(self.current_dir, self.results_folder_name)
+        self.catalog = self.open_catalog(results_dir)
+        if mazes == 'all':
+            if self.catalog:
+                mazes = self.catalog.folders()
+            else:
+                mazes = [file for file in self.scan_file(results_dir, quiet=True) if isdir(join(results_dir, file))]
+
+        configs = []
+        for folder in mazes:
+            target_dir = join(results_dir, folder)
+            config_file_list = self.config_files(target_dir)
+            if not config_file_list:
+                raise ValueError(f'No {self.config_ext} maze config file in {target_dir}')
+            configs.append((join(target_dir, config_file_list[0]), target_dir))
+        check_encoding(encoding, bram)
+        export = {'formats': formats, 'radix': radix, 'rounding': rounding, 'overflow': overflow, 'pack_ns': pack_ns,
+                  'encoding': encoding, 'bram': bram}
+        with self.instrument.stage('gen_NS_batch', mazes=len(configs)):
+            ns_mems = pool_map(coe_ns_job, [config + (export,) for config in configs], workers,
+                               lambda done, total: self.instrument.progress('gen_NS_batch', done, total))
+
+        # Split the goals of the mazes in chunks, so that a few mazes with
+        # many goals still keep every worker busy
+        chunks = max(1, -(-workers // max(1, len(configs))))
+        jobs = []
+        for (config_file, target_dir), (N, ns_names) in zip(configs, ns_mems):
+            maze_goals = list(range(N)) if goals == 'all' else [int(goal) for goal in goals]
+            if any(not 0 <= goal < N for goal in maze_goals):
+                raise ValueError(f'Goal states of {target_dir} must be in 0-{N-1}')
+            size = max(1, -(-len(maze_goals) // chunks))
+            for start in range(0, len(maze_goals), size):
+                jobs.append((config_file, target_dir, maze_goals[start:start + size], q_formats, goal_reward,
+                             ns_names, export))
+        with self.instrument.stage('gen_COE_batch', mazes=len(configs), sets=0) as counters:
+            results = pool_map(coe_goal_job, jobs, workers,
+                               lambda done, total: self.instrument.progress('gen_COE_batch', done, total))
+            coe_dirs = [coe_dir for dirs in results for coe_dir in dirs]
+            counters['sets'] = len(coe_dirs)
+        self.instrument.log(f'Generated {len(coe_dirs)} COE set(s) for {len(configs)} maze(s)', SUMMARY)
+        return coe_dirs
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate the COE files of many maze, goal and Q format combinations.')
+    parser.add_argument('results', help='results folder, relative to the current directory')
+    parser.add_argument('-m', '--mazes', nargs='+', default=['all'], help='result folder names, or all (default)')
+    parser.add_argument('-g', '--goals', nargs='+', default=['all'], help='goal states, or all (default)')
+    parser.add_argument('-q', '--q-formats', nargs='+', required=True, metavar='WIDTH-FRAC',
+                        help='fixed-point formats, e.g. 32-16')
+    parser.add_argument('-r', '--goal-reward', type=float, default=10)
+    parser.add_argument('-f', '--config-format', choices=('txt', 'bin'), default='txt')
+    parser.add_argument('-o', '--output-formats', nargs='+', choices=tuple(mem_export.EXPORTS), default=['coe'],
+                        help='memory file formats (default coe)')
+    parser.add_argument('--radix', type=int, choices=(2, 10, 16), default=10, help='radix of the COE files')
+    parser.add_argument('--rounding', choices=tuple(mem_export.ROUNDING), default='trunc')
+    parser.add_argument('--overflow', choices=mem_export.OVERFLOW, default='wrap')
+    parser.add_argument('--pack-ns', action='store_true', help='pack the next states of a state in one word')
+    parser.add_argument('--encoding', choices=ENCODINGS, default='full',
+                        help='full NS/RT memories (default) or compact cell words and reward table')
+    parser.add_argument('--bram', metavar='DEPTHxWIDTH', help='split the memories in banks of this BRAM, e.g. 1024x36')
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument('-v', '--verbose', type=int, choices=(0, 1, 2), default=1,
+                        help='0: silent, 1: stage summaries (default), 2: every message')
+    parser.add_argument('--metrics', help='JSON lines file the stage timings are appended to')
+    parser.add_argument('--progress', action='store_true', help='draw a progress bar')
+    args = parser.parse_args(argv)
+
+    q_formats = [tuple(int(v) for v in q.split('-')) for q in args.q_formats]
+    mazes = 'all' if args.mazes == ['all'] else args.mazes
+    goals = 'all' if args.goals == ['all'] else [int(goal) for goal in args.goals]
+    bram = tuple(int(v) for v in args.bram.lower().split('x')) if args.bram else None
+    sinks = [PrintSink()] if args.verbose else []
+    if args.metrics:
+        sinks.append(JsonlSink(args.metrics))
+    if args.progress:
+        sinks.append(ProgressSink())
+    coe = COEgen(args.results, args.config_format, args.verbose, sinks)
+    coe.gen_COE_batch(mazes, goals, q_formats, args.goal_reward, args.workers, args.radix, args.output_formats,
+                      args.rounding, args.overflow, args.pack_ns, args.encoding, bram)
+
+if __name__ == '__main__':
+    main()
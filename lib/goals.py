@@ -0,0 +1,67 @@
+import numpy as np
+# Goal state rewards.
+#
+# Moving into the goal state from another state is rewarded with the goal
+# reward. Instead of scanning the whole (N, Z) NS matrix for every goal,
+# GoalIndex builds the reverse transitions once, in CSR form: the (state,
+# action) entries moving into state s are entries[indptr[s]:indptr[s+1]],
+# stored as flat indices state*Z + action of the NS/RT matrices. Applying a
+# goal then only touches its few incoming entries.
+
+class GoalIndex:
+    def __init__(self, NS):
+        NS = np.asarray(NS)
+        self.N, self.Z = NS.shape
+        ns = NS.ravel()
+        # Staying in place (hitting a wall) never enters a goal
+        moves = np.flatnonzero(ns != np.arange(ns.size) // self.Z)
+        self.entries = moves[np.argsort(ns[moves], kind='stable')]
+        self.indptr = np.zeros(self.N + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ns[moves], minlength=self.N), out=self.indptr[1:])
+
+    def incoming(self, goal):
+        """Return the flat indices (state*Z + action) of the entries moving into goal."""
+
+        return self.entries[self.indptr[goal]:self.indptr[goal + 1]]
+
+    def incoming_pairs(self, goal):
+        """Return the (states, actions) arrays of the entries moving into goal."""
+
+        return np.divmod(self.incoming(goal), self.Z)
+
+    def degree(self):
+        """Return the number of entries moving into each state."""
+
+        return np.diff(self.indptr)
+
+    def apply(self, RT, goals, goal_reward=10):
+        """Return a copy of RT with the rewards of one or many goals.
+
+        goals is a state or a list of states, goal_reward a single reward or
+        one reward per goal. RT is left untouched.
+
+        """
+        goals = np.atleast_1d(goals)
+        rewards = np.broadcast_to(goal_reward, goals.shape)
+        rt = np.array(RT)
+        flat = rt.reshape(-1)
+        for goal, reward in zip(goals.tolist(), rewards.tolist()):
+            flat[self.incoming(goal)] = reward
+        return rt
+
+    def sweep(self, RT, goals=None, goal_reward=10):
+        """Yield (goal, RT with the reward of goal) for each goal (every state by default).
+
+        The yielded array is a single buffer, updated in place from one goal
+        to the next: copy it to keep it.
+
+        """
+        goals = range(self.N) if goals is None else goals
+        rt = np.array(RT)
+        flat = rt.reshape(-1)
+        base = np.asarray(RT).reshape(-1)
+        for goal in goals:
+            idx = self.incoming(goal)
+            flat[idx] = goal_reward
+            yield goal, rt
+            flat[idx] = base[idx]
@@ -0,0 +1,140 @@
+import numpy as np
+
+from lib import map_gen as mg
+# Imperfect mazes: passes removing walls of a carved (perfect) maze.
+#
+# - carve_rooms: open rectangular rooms, every wall inside them is removed
+# - braid_dead_ends: open one more wall of each dead end with probability p,
+#   turning it into a loop
+# - knock_down_walls: remove k random interior walls
+#
+# The passes only remove walls, so every cell stays reachable. They work on
+# the whole (ny, nx) passage arrays at once, as the vectorized carving
+# algorithms, and draw their random numbers from the generator of the maze:
+# a seeded maze gets the same walls with the same parameters.
+
+# Parameters of make_imperfect, and their defaults (no pass)
+PASSES = {'rooms': 0, 'room_size': (2, 5), 'braid': 0.0, 'knock': 0}
+
+# Number of walls of each wall nibble
+WALL_COUNT = np.array([bin(nibble).count('1') for nibble in range(16)], dtype=np.uint8)
+
+def check_params(params):
+    """Return the imperfect pass parameters as a dict, raise ValueError on unknown ones."""
+
+    params = dict(params or {})
+    unknown = set(params) - set(PASSES)
+    if unknown:
+        raise ValueError(f"Unknown imperfect maze parameters {', '.join(sorted(unknown))}. "
+                         f"Choose from {', '.join(PASSES)}.")
+    if not 0 <= params.get('braid', 0) <= 1:
+        raise ValueError('braid is a probability, between 0 and 1')
+    for name, count in (('rooms', 'rooms'), ('knock', 'walls')):
+        if not is_count(params.get(name, 0)):
+            raise ValueError(f'{name} is a number of {count}, an integer of at least 0')
+    size = params.get('room_size', PASSES['room_size'])
+    if not (isinstance(size, (tuple, list)) and len(size) == 2 and all(is_count(side) for side in size) and 1 <= size[0] <= size[1]):
+        raise ValueError('room_size is the (smallest, largest) side of the rooms, integers with 1 <= smallest <= largest')
+    return params
+
+def is_count(value):
+    # Integer of at least 0, bools excluded
+    return isinstance(value, (int, np.integer)) and not isinstance(value, bool) and value >= 0
+
+def passages(walls):
+    """Return the (open_s, open_e) passages of a wall array, the inverse of mg.walls_from_passages."""
+
+    return (walls & mg.WALL_BITS['S']) == 0, (walls & mg.WALL_BITS['E']) == 0
+
+def closed_walls(open_s, open_e):
+    # Interior walls still standing, south walls then east walls
+    closed_s = ~open_s
+    closed_s[-1] = False
+    closed_e = ~open_e
+    closed_e[:, -1] = False
+    return closed_s, closed_e
+
+def interior_walls(nx, ny):
+    """Return the number of interior walls of a nx x ny grid."""
+
+    return nx*(ny - 1) + ny*(nx - 1)
+
+def wall_density(walls):
+    """Return the fraction of the interior walls still standing."""
+
+    ny, nx = walls.shape
+    closed_s, closed_e = closed_walls(*passages(walls))
+    total = interior_walls(nx, ny)
+    return float(closed_s.sum() + closed_e.sum()) / total if total else 0.0
+
+def loop_count(walls):
+    """Return the number of independent loops of a maze, 0 for a perfect maze."""
+
+    ny, nx = walls.shape
+    closed_s, closed_e = closed_walls(*passages(walls))
+    opened = interior_walls(nx, ny) - int(closed_s.sum() + closed_e.sum())
+    # Every cell is reachable: a spanning tree has N-1 passages
+    return opened - (nx*ny - 1)
+
+def carve_rooms(walls, rooms, room_size, rng):
+    """Return walls with `rooms` random rooms, of room_size (min, max) cells per side, opened."""
+
+    open_s, open_e = passages(walls)
+    ny, nx = walls.shape
+    lo, hi = room_size
+    widths = np.minimum(rng.integers(lo, hi + 1, size=rooms), nx)
+    heights = np.minimum(rng.integers(lo, hi + 1, size=rooms), ny)
+    xs = rng.integers(0, nx - widths + 1)
+    ys = rng.integers(0, ny - heights + 1)
+    for x, y, w, h in zip(xs.tolist(), ys.tolist(), widths.tolist(), heights.tolist()):
+        open_s[y:y + h - 1, x:x + w] = True
+        open_e[y:y + h, x:x + w - 1] = True
+    return mg.walls_from_passages(open_s, open_e)
+
+def braid_dead_ends(walls, p, rng):
+    """Return walls with one more wall of each dead end removed, with probability p."""
+
+    open_s, open_e = passages(walls)
+    ny, nx = walls.shape
+    dead = WALL_COUNT[walls] == 3
+    ys, xs = np.nonzero(dead & (rng.random(walls.shape) < p))
+    # Interior walls of the selected dead ends, in the S, E, W, N order
+    w = walls[ys, xs]
+    candidates = np.stack([(w & mg.WALL_BITS['S'] != 0) & (ys < ny - 1),
+                           (w & mg.WALL_BITS['E'] != 0) & (xs < nx - 1),
+                           (w & mg.WALL_BITS['W'] != 0) & (xs > 0),
+                           (w & mg.WALL_BITS['N'] != 0) & (ys > 0)], axis=1)
+    # A random wall among the candidates: the largest random key
+    keys = np.where(candidates, rng.random(candidates.shape), -1.0)
+    side = keys.argmax(axis=1)
+    keep = candidates.any(axis=1)
+    ys, xs, side = ys[keep], xs[keep], side[keep]
+    open_s[ys[side == 0], xs[side == 0]] = True
+    open_e[ys[side == 1], xs[side == 1]] = True
+    open_e[ys[side == 2], xs[side == 2] - 1] = True
+    open_s[ys[side == 3] - 1, xs[side == 3]] = True
+    return mg.walls_from_passages(open_s, open_e)
+
+def knock_down_walls(walls, k, rng):
+    """Return walls with k random interior walls removed (all of them when fewer are left)."""
+
+    open_s, open_e = passages(walls)
+    closed_s, closed_e = closed_walls(open_s, open_e)
+    # South walls are numbered 0..N-1, east walls N..2N-1
+    ids = np.flatnonzero(np.concatenate([closed_s.ravel(), closed_e.ravel()]))
+    picked = ids[rng.choice(ids.size, size=min(k, ids.size), replace=False)]
+    n = walls.size
+    open_s.ravel()[picked[picked < n]] = True
+    open_e.ravel()[picked[picked >= n] - n] = True
+    return mg.walls_from_passages(open_s, open_e)
+
+def make_imperfect(walls, rng, rooms=0, room_size=(2, 5), braid=0.0, knock=0):
+    """Return walls after the rooms, braid and knock passes, skipping the passes left at 0."""
+
+    if rooms:
+        walls = carve_rooms(walls, rooms, room_size, rng)
+    if braid:
+        walls = braid_dead_ends(walls, braid, rng)
+    if knock:
+        walls = knock_down_walls(walls, knock, rng)
+    return walls
@@ -0,0 +1,146 @@
+import json
+import resource
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+# Stage timing, counters and progress reporting.
+#
+# gridMazeGen and COEgen report through an Instrument instead of printing:
+# - log(text, level): messages, kept when level <= verbose
+#   (0: silent, 1: one summary line per stage, 2: every message, default)
+# - stage(name, **counters): context manager timing a stage, its counters
+#   (mazes, cells, bytes, ...) can be updated inside the block. The record
+#   of the stage (time, peak RSS, counters and their rates) goes to every sink
+# - progress(name, done, total): progress of the items of a stage
+#
+# Sinks receive all of them and keep what they need: PrintSink prints,
+# LogSink goes through the logging module, JsonlSink appends the stage
+# records to a JSON lines file, ProgressSink draws a progress bar.
+
+QUIET, SUMMARY, DETAIL = 0, 1, 2
+
+def reset_peak_rss():
+    """Reset the peak RSS (VmHWM) of the process, Linux only. Returns whether it was reset."""
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    """Return the peak RSS of the process in kB, since the last reset when supported."""
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+class Sink:
+    # Sinks ignore what they don't handle
+    def message(self, text):
+        pass
+
+    def stage(self, record):
+        pass
+
+    def progress(self, name, done, total):
+        pass
+
+class PrintSink(Sink):
+    def message(self, text):
+        print(text)
+
+    def stage(self, record):
+        counters = ''.join([f', {record[key]} {key}' for key in record['counters']])
+        print(f"{record['stage']}: {record['seconds']:.3f} s{counters}")
+
+class LogSink(Sink):
+    def __init__(self, logger='gridmaze', level=None):
+        import logging
+        self.logger = logging.getLogger(logger) if isinstance(logger, str) else logger
+        self.level = logging.INFO if level is None else level
+
+    def message(self, text):
+        self.logger.log(self.level, text)
+
+    def stage(self, record):
+        self.logger.log(self.level, 'stage %s', json.dumps(record))
+
+class JsonlSink(Sink):
+    """Append the stage records to a JSON lines file."""
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def stage(self, record):
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+class ProgressSink(Sink):
+    """Draw a progress bar of the stage items, on stderr by default."""
+
+    def __init__(self, stream=None, width=30):
+        self.stream = stream
+        self.width = width
+
+    def progress(self, name, done, total):
+        stream = self.stream or sys.stderr
+        filled = self.width * done // max(total, 1)
+        stream.write(f"\r{name} [{'#' * filled}{'.' * (self.width - filled)}] {done}/{total}")
+        if done >= total:
+            stream.write('\n')
+        stream.flush()
+
+class Instrument:
+    def __init__(self, verbose=DETAIL, sinks=None):
+        self.verbose = verbose
+        # Print by default, unless silent
+        self.sinks = ([PrintSink()] if verbose > QUIET else []) if sinks is None else list(sinks)
+        self.stages = []
+
+    def worker(self):
+        """Return the Instrument of a worker process: same verbosity, only printing."""
+
+        printing = any(isinstance(sink, PrintSink) for sink in self.sinks)
+        return Instrument(self.verbose, [PrintSink()] if printing else [])
+
+    def log(self, text, level=DETAIL):
+        if level <= self.verbose:
+            for sink in self.sinks:
+                sink.message(text)
+
+    @contextmanager
+    def stage(self, name, **counters):
+        """Time the block as stage name, yield its counters to update them."""
+
+        start = perf_counter()
+        yield counters
+        seconds = perf_counter() - start
+        record = {'stage': name, 'time': datetime.now().isoformat(timespec='seconds'), 'seconds': seconds,
+                  'peak_rss_kb': peak_rss(), 'counters': list(counters)}
+        for key, value in counters.items():
+            record[key] = value
+            if seconds > 0:
+                record[f'{key}_per_s'] = value / seconds
+        self.stages.append(record)
+        if self.verbose >= SUMMARY:
+            for sink in self.sinks:
+                sink.stage(record)
+        else:
+            # Silent runs still record their metrics
+            for sink in self.sinks:
+                if isinstance(sink, JsonlSink):
+                    sink.stage(record)
+
+    def progress(self, name, done, total):
+        for sink in self.sinks:
+            sink.progress(name, done, total)
@@ -1,82 +1,291 @@
-import random
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from lib import carve
+from lib import imperfect as imperfect_passes
 # Create a maze using the depth-first algorithm described at
 # https://scipython.com/blog/making-a-maze/
 # Christian Hill, April 2017.
 
 # Added Modification:
 # - SVG drawing also draw maze state and border
+# - Walls are stored as one nibble per cell in a NumPy array instead of one
+#   Cell object (and dict) per cell
+# - Carving algorithm is selectable, see lib/carve.py
+
+# Bit of each wall inside the nibble stored for every cell
+WALL_BITS = {'N': 1, 'S': 2, 'E': 4, 'W': 8}
+ALL_WALLS = 15
+
+# Actions of the agent, in the column order of the NS/RT matrices, with the
+# wall blocking each of them
+ACTIONS = ('down', 'right', 'left', 'up')
+ACTION_WALLS = np.array([WALL_BITS['S'], WALL_BITS['E'], WALL_BITS['W'], WALL_BITS['N']],
+                        dtype=np.uint8)
+
+# Action models, by number of actions. 8-connected agents can also move
+# diagonally: a diagonal move is open when one of the two L-shaped routes
+# through the neighbouring cells is, so it shortcuts a two steps path.
+ACTION_MODELS = {
+    4: ACTIONS,
+    8: ACTIONS + ('down-right', 'down-left', 'up-right', 'up-left'),
+}
+# (dx, dy) of each action
+ACTION_STEPS = {'down': (0, 1), 'right': (1, 0), 'left': (-1, 0), 'up': (0, -1),
+                'down-right': (1, 1), 'down-left': (-1, 1), 'up-right': (1, -1), 'up-left': (-1, -1)}
+
+def maze_size(dim):
+    """Return the (nx, ny) of a maze dimension, a size or a (width, height) pair."""
+
+    if isinstance(dim, (tuple, list)):
+        nx, ny = dim
+        return int(nx), int(ny)
+    return int(dim), int(dim)
+
+def check_actions(actions):
+    if actions not in ACTION_MODELS:
+        raise ValueError(f"Unknown action model {actions}. Choose from {', '.join(map(str, ACTION_MODELS))}.")
+
+def shifted(a, dx, dy):
+    # a[..., y+dy, x+dx] at [..., y, x], True outside of the grid
+    rows, cols = a.shape[-2:]
+    out = np.ones_like(a)
+    out[..., max(0, -dy):rows - max(0, dy), max(0, -dx):cols - max(0, dx)] = \
+        a[..., max(0, dy):rows - max(0, -dy), max(0, dx):cols - max(0, -dx)]
+    return out
+
+def walls_from_passages(open_s, open_e):
+    """Return the (ny, nx) wall nibbles of a grid from its carved passages.
+
+    open_s and open_e are the (ny, nx) bool arrays returned by the carving
+    algorithms of lib/carve.py, or (B, ny, nx) arrays of a batch of mazes.
+
+    """
+    open_s = open_s.astype(np.uint8)
+    open_e = open_e.astype(np.uint8)
+    walls = np.full(open_s.shape, ALL_WALLS, dtype=np.uint8)
+    walls -= open_s * np.uint8(WALL_BITS['S'])
+    walls -= open_e * np.uint8(WALL_BITS['E'])
+    # A passage to the south (east) is also one to the north (west) of the
+    # neighbouring cell
+    walls[..., 1:, :] -= open_s[..., :-1, :] * np.uint8(WALL_BITS['N'])
+    walls[..., :, 1:] -= open_e[..., :, :-1] * np.uint8(WALL_BITS['W'])
+    return walls
+
+def walls_to_blocked(walls, actions=4):
+    """Return a (N, Z) bool array, True where an action runs into a wall.
+
+    walls is a (rows, nx) wall array, either a whole maze or a band of rows
+    (4 actions only: diagonal moves look at the rows around the band), or a
+    (B, ny, nx) batch of mazes, giving (B*N, Z). The outer border of a maze
+    is always walled, so the agent never leaves the grid.
+
+    """
+    blocked = (walls.reshape(-1, 1) & ACTION_WALLS) != 0
+    if actions == 4:
+        return blocked
+    check_actions(actions)
+    sides = blocked.reshape(walls.shape + (4,))
+    diagonals = []
+    for action in ACTION_MODELS[actions][4:]:
+        dx, dy = ACTION_STEPS[action]
+        horizontal = sides[..., 1 if dx > 0 else 2]
+        vertical = sides[..., 0 if dy > 0 else 3]
+        # Horizontal then vertical step, or vertical then horizontal step
+        diagonals.append((horizontal | shifted(vertical, dx, 0)) & (vertical | shifted(horizontal, 0, dy)))
+    return np.concatenate([blocked, np.stack(diagonals, axis=-1).reshape(-1, len(diagonals))], axis=1)
+
+def blocked_at(walls, states, actions=4):
+    """Return the (k, Z) blocked actions of some states of a maze, as walls_to_blocked."""
+
+    ny, nx = walls.shape
+    ys, xs = np.divmod(np.asarray(states), nx)
+    blocked = (walls[ys, xs].reshape(-1, 1) & ACTION_WALLS) != 0
+    if actions == 4:
+        return blocked
+    diagonals = []
+    for action in ACTION_MODELS[actions][4:]:
+        dx, dy = ACTION_STEPS[action]
+        # Clipped cells are never used: the first step is already blocked by the border
+        x2, y2 = np.clip(xs + dx, 0, nx - 1), np.clip(ys + dy, 0, ny - 1)
+        horizontal = blocked[:, 1 if dx > 0 else 2]
+        vertical = blocked[:, 0 if dy > 0 else 3]
+        vertical_after = (walls[ys, x2] & WALL_BITS['S' if dy > 0 else 'N']) != 0
+        horizontal_after = (walls[y2, xs] & WALL_BITS['E' if dx > 0 else 'W']) != 0
+        diagonals.append((horizontal | vertical_after) & (vertical | horizontal_after))
+    return np.concatenate([blocked, np.stack(diagonals, axis=1)], axis=1)
+
+def walls_to_next_state(walls, first_state=0, blocked=None, actions=4):
+    """Return the (N, Z) int32 next state of every (state, action) pair.
+
+    first_state is the state number of walls[0, 0], non zero when walls is
+    a band of rows taken from a larger maze. States beyond the int32 range
+    (mazes above 2^31 cells) are returned as int64.
+
+    """
+    if blocked is None:
+        blocked = walls_to_blocked(walls, actions)
+    nx = walls.shape[1]
+    dtype = np.int32 if first_state + walls.size + nx + 1 <= np.iinfo(np.int32).max else np.int64
+    states = np.arange(first_state, first_state + walls.size, dtype=dtype).reshape(-1, 1)
+    steps = [dx + nx*dy for dx, dy in (ACTION_STEPS[action] for action in ACTION_MODELS[actions])]
+    next_states = states + np.array(steps, dtype=dtype)
+    # Agent stays in place when it hits a wall
+    np.copyto(next_states, states, where=blocked)
+    return next_states
+
+def walls_to_rewards(walls, r_default, r_wall, blocked=None, actions=4):
+    """Return the (N, Z) float32 reward of every (state, action) pair."""
+
+    if blocked is None:
+        blocked = walls_to_blocked(walls, actions)
+    rewards = np.full(blocked.shape, r_default, dtype=np.float32)
+    rewards[blocked] = r_wall
+    return rewards
+
+class CellWalls(MutableMapping):
+    """Dict-like view on the walls of a single cell of a Maze."""
+
+    def __init__(self, walls, x, y):
+        self._walls = walls
+        self.x, self.y = x, y
+
+    def __getitem__(self, wall):
+        return bool(self._walls[self.y, self.x] & WALL_BITS[wall])
+
+    def __setitem__(self, wall, value):
+        if value:
+            self._walls[self.y, self.x] |= WALL_BITS[wall]
+        else:
+            self._walls[self.y, self.x] &= ALL_WALLS ^ WALL_BITS[wall]
+
+    def __delitem__(self, wall):
+        raise TypeError('Walls of a cell cannot be deleted')
+
+    def __iter__(self):
+        return iter(WALL_BITS)
+
+    def __len__(self):
+        return len(WALL_BITS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
 class Cell:
     """A cell in the maze.
 
     A maze "Cell" is a point in the grid which may be surrounded by walls to
-    the north, east, south or west.
+    the north, east, south or west. Cells are only views on the wall array
+    of their Maze, they are created on demand by Maze.cell_at().
 
     """
 
     # A wall separates a pair of cells in the N-S or W-E directions.
     wall_pairs = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
 
-    def __init__(self, x, y):
-        """Initialize the cell at (x,y). At first it is surrounded by walls."""
+    def __init__(self, maze, x, y):
+        """Initialize the view on the cell at (x,y) of maze."""
 
+        self.maze = maze
         self.x, self.y = x, y
-        self.walls = {'N': True, 'S': True, 'E': True, 'W': True}
+
+    @property
+    def walls(self):
+        """Walls of the cell, as a dict-like view on the maze wall array."""
+
+        return CellWalls(self.maze.walls, self.x, self.y)
 
     def has_all_walls(self):
         """Does this cell still have all its walls?"""
 
-        return all(self.walls.values())
+        return bool(self.maze.walls[self.y, self.x] == ALL_WALLS)
 
     def knock_down_wall(self, other, wall):
         """Knock down the wall between cells self and other."""
 
-        self.walls[wall] = False
-        other.walls[Cell.wall_pairs[wall]] = False
+        self.maze.walls[self.y, self.x] &= ALL_WALLS ^ WALL_BITS[wall]
+        other.maze.walls[other.y, other.x] &= ALL_WALLS ^ WALL_BITS[Cell.wall_pairs[wall]]
 
 class Maze:
-    """A Maze, represented as a grid of cells."""
+    """A Maze, represented as a grid of cells.
+
+    The walls of every cell are packed in a single nibble (see WALL_BITS) of
+    the uint8 array self.walls, indexed as walls[y, x]. The flat index of a
+    cell in that array is its state number x+nx*y.
+
+    """
 
-    def __init__(self, dim):
+    def __init__(self, dim, algorithm='dfs', seed=None, actions=4, imperfect=None):
         """Initialize the maze grid.
-        The maze consists of nx x ny cells and will be constructed starting
-        at the cell indexed at (ix, iy).
+        The maze consists of nx x ny cells (dim is a size, or a (nx, ny)
+        pair) and will be constructed starting at the cell indexed at
+        (ix, iy), with one of the carving algorithms of carve.ALGORITHMS.
+        seed seeds the random generator of the maze, actions selects the
+        action model of its matrices (ACTION_MODELS, 4 or 8). imperfect
+        holds the parameters of the passes of lib/imperfect.py run after
+        carving (rooms, room_size, braid, knock), None for a perfect maze.
 
         """
+        if algorithm not in carve.ALGORITHMS:
+            raise ValueError(f"Unknown maze algorithm '{algorithm}'. "
+                             f"Choose from {', '.join(carve.ALGORITHMS)}.")
+        check_actions(actions)
+        self.imperfect = imperfect_passes.check_params(imperfect)
+        self.algorithm = algorithm
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
         # Maze dimensions
-        self.nx = dim
-        self.ny = dim
+        self.nx, self.ny = maze_size(dim)
 
         # Maze entry point
-        self.ix = random.randint(0, self.nx-1)
-        self.iy = random.randint(0, self.ny-1)
-        self.maze_map = [[Cell(x, y) for y in range(self.ny)] for x in range(self.nx)]
+        self.ix = int(self.rng.integers(self.nx))
+        self.iy = int(self.rng.integers(self.ny))
+        # At first every cell is surrounded by walls
+        self.walls = np.full((self.ny, self.nx), ALL_WALLS, dtype=np.uint8)
         
         # Number of actions
-        self.Z = 4
+        self.actions = actions
+        self.Z = len(ACTION_MODELS[actions])
         
         # Number of states
         self.N = self.nx*self.ny
 
     def cell_at(self, x, y):
-        """Return the Cell object at (x,y)."""
+        """Return a Cell view on the cell at (x,y)."""
+
+        return Cell(self, x, y)
+
+    def wall_mask(self, wall):
+        """Return a (ny, nx) bool array, True where cells have the given wall."""
+
+        return (self.walls & WALL_BITS[wall]) != 0
 
-        return self.maze_map[x][y]
+    def knock_down_wall(self, x, y, wall):
+        """Knock down the given wall of the cell at (x,y) and its neighbour."""
+
+        dx, dy = {'N': (0, -1), 'S': (0, 1), 'E': (1, 0), 'W': (-1, 0)}[wall]
+        self.walls[y, x] &= ALL_WALLS ^ WALL_BITS[wall]
+        self.walls[y+dy, x+dx] &= ALL_WALLS ^ WALL_BITS[Cell.wall_pairs[wall]]
 
     def __str__(self):
         """Return a (crude) string representation of the maze."""
 
+        east = self.wall_mask('E').tolist()
+        south = self.wall_mask('S').tolist()
         maze_rows = ['-' * self.nx * 2]
         for y in range(self.ny):
             maze_row = ['|']
             for x in range(self.nx):
-                if self.maze_map[x][y].walls['E']:
+                if east[y][x]:
                     maze_row.append(' |')
                 else:
                     maze_row.append('  ')
             maze_rows.append(''.join(maze_row))
             maze_row = ['|']
             for x in range(self.nx):
-                if self.maze_map[x][y].walls['S']:
+                if south[y][x]:
                     maze_row.append('-+')
                 else:
                     maze_row.append(' +')
@@ -84,139 +293,136 @@ class Maze:
         return '\n'.join(maze_rows)
 
     def gen_next_state(self):
-        n_states = self.nx * self.ny
-        next_states = [[0] * self.Z for i in range(n_states)]
-
-        eastmost = self.nx-1
-        southmost = self.ny-1
-        for y in range(self.ny):
-            for x in range(self.nx):
-                down, right, left, up = 0, 1, 2, 3
-                agent_pos = x+self.nx*y
-                # north_of_pos = agent_pos-self.nx
-                south_of_pos = agent_pos+self.nx
-                # west_of_pos = agent_pos-1
-                east_of_pos = agent_pos+1
-                
-                # Check if wall exist south of the current position (x,y)
-                # Also, check if wall exist norht of (x,y+1)
-                if self.cell_at(x, y).walls['S']:
-                    # Wall exist, agent stays
-                    next_states[agent_pos][down] = agent_pos
-                    if (y < southmost):
-                        # If (x,y) has south wall, then (x,y+1) has north wall
-                        next_states[south_of_pos][up] = south_of_pos
-                else:
-                    # Wall dont exist, agent can move to the south
-                    next_states[agent_pos][down] = south_of_pos
-                    if (y < southmost):
-                        # If (x,y) doesnt have south wall, then (x,y+1) doenst have north wall.
-                        # Therefore, in (x,y+1), agent can move to the north
-                        next_states[south_of_pos][up] = agent_pos
-                
-                # Check if wall exist east of the current position (x,y)
-                # Also, check if wall exist west of (x+1,y)       
-                if self.cell_at(x, y).walls['E']:
-                    # Wall exist, agent stays
-                    next_states[agent_pos][right] = agent_pos
-                    if (x < eastmost):
-                        # If (x,y) has south wall, then (x,y+1) has north wall
-                        next_states[east_of_pos][left] = east_of_pos
-                else:
-                    # Wall dont exist, agent can move to the east
-                    next_states[agent_pos][right] = east_of_pos
-                    if (x < eastmost):
-                        # If (x,y) doesnt have east wall, then (x,y+1) doenst have west wall.
-                        # Therefore, in (x,y+1), agent can move to the west 
-                        next_states[east_of_pos][left] = agent_pos
-
-                # Special Case 1: Agent on the norhtmost positions of maze
-                if (y == 0): 
-                    next_states[agent_pos][up] = agent_pos
-
-                # Special Case 1: Agent on the westmost positions of maze
-                if (x == 0):
-                    next_states[agent_pos][left] = agent_pos
+        """Generate the (N, Z) int32 state transition matrix of the maze."""
 
+        next_states = walls_to_next_state(self.walls, actions=self.actions)
         self.state_transition_matrix = next_states
         return next_states
-    
-    def gen_rewards(self, r_default, r_wall):
-        n_states = self.nx * self.ny
-        rewards = [[r_default] * self.Z for i in range(n_states)]
-        
-        down, right, left, up = 0, 1, 2, 3
-        
-        eastmost = self.nx-1
-        southmost = self.ny-1
 
-        # Add wall rewards
-        for y in range(self.ny):
-            for x in range(self.nx):
-                agent_pos = x+self.nx*y
-                north_of_pos = agent_pos-self.nx
-                south_of_pos = agent_pos+self.nx
-                west_of_pos = agent_pos-1
-                east_of_pos = agent_pos+1
-
-                # Check if wall exist south of the current position (x,y)
-                # Also, check if wall exist norht of (x,y+1)
-                if self.cell_at(x, y).walls['S']:
-                    # Wall exist. If agent move down, then it get punishment
-                    rewards[agent_pos][down] = r_wall
-                    if (y < southmost):
-                        # If (x,y) has south wall, then (x,y+1) has north wall
-                        rewards[south_of_pos][up] = r_wall
-                
-                # Check if wall exist east of the current position (x,y)
-                # Also, check if wall exist west of (x+1,y)       
-                if self.cell_at(x, y).walls['E']:
-                    # Wall exist, agent stays
-                    rewards[agent_pos][right] = r_wall
-                    if (x < eastmost):
-                        # If (x,y) has south wall, then (x,y+1) has north wall
-                        rewards[east_of_pos][left] = r_wall
-
-                # Special Case 1: Agent on the norhtmost positions of maze
-                if (y == 0): 
-                    rewards[agent_pos][up] = r_wall
-
-                # Special Case 1: Agent on the westmost positions of maze
-                if (x == 0):
-                    rewards[agent_pos][left] = r_wall
+    def gen_rewards(self, r_default, r_wall):
+        """Generate the (N, Z) float32 reward matrix of the maze."""
 
+        rewards = walls_to_rewards(self.walls, r_default, r_wall, actions=self.actions)
         self.reward_matrix = rewards
+        # Kept for the wall edits
+        self.r_default, self.r_wall = r_default, r_wall
         return rewards
-    
+
+    def gen_matrices(self, r_default, r_wall):
+        """Generate both the state transition and reward matrices in one pass."""
+
+        blocked = walls_to_blocked(self.walls, self.actions)
+        self.state_transition_matrix = walls_to_next_state(self.walls, blocked=blocked, actions=self.actions)
+        self.reward_matrix = walls_to_rewards(self.walls, r_default, r_wall, blocked=blocked)
+        self.r_default, self.r_wall = r_default, r_wall
+        return self.state_transition_matrix, self.reward_matrix
+
+    def set_walls(self, edits):
+        """Add or remove walls, updating only the matrix entries they change.
+
+        edits is a list of (x, y, wall, present): the wall ('N', 'S', 'E' or
+        'W') of the cell at (x,y), and of its neighbour, is added when
+        present is true and removed otherwise. The NS/RT matrices, when
+        generated, are rebuilt for the states around the edited walls only.
+
+        Returns the diff of the matrices, a dict of the state, action, ns and
+        rt (when the rewards were generated) arrays of the changed entries,
+        to patch a copy of the matrices (see COEgen.apply_diff) instead of
+        reloading them.
+
+        """
+        # Every edit is checked before the walls change, a bad one leaves the
+        # maze as it was
+        checked = []
+        for x, y, wall, present in edits:
+            if wall not in WALL_BITS:
+                raise ValueError(f"Unknown wall '{wall}'. Choose from {', '.join(WALL_BITS)}.")
+            dx, dy = {'N': (0, -1), 'S': (0, 1), 'E': (1, 0), 'W': (-1, 0)}[wall]
+            if not (0 <= x < self.nx and 0 <= y < self.ny):
+                raise ValueError(f'Cell ({x},{y}) is out of the {self.nx}X{self.ny} maze')
+            if not (0 <= x+dx < self.nx and 0 <= y+dy < self.ny):
+                if present:
+                    continue
+                raise ValueError(f'The {wall} wall of ({x},{y}) is on the border of the maze')
+            checked.append((x, y, wall, present, dx, dy))
+
+        touched = []
+        for x, y, wall, present, dx, dy in checked:
+            if present:
+                self.walls[y, x] |= WALL_BITS[wall]
+                self.walls[y+dy, x+dx] |= WALL_BITS[Cell.wall_pairs[wall]]
+            else:
+                self.knock_down_wall(x, y, wall)
+            touched += [(x, y), (x+dx, y+dy)]
+
+        diff = {'state': np.zeros(0, dtype=np.int64), 'action': np.zeros(0, dtype=np.int8)}
+        ns = getattr(self, 'state_transition_matrix', None)
+        if not touched or ns is None:
+            return diff
+        xs, ys = np.array(touched).T
+        if self.actions != 4:
+            # Diagonal moves of the neighbours also go around the edited walls
+            offsets = np.arange(-1, 2)
+            xs = np.clip(xs.reshape(-1, 1, 1) + offsets.reshape(1, 1, -1), 0, self.nx - 1)
+            ys = np.clip(ys.reshape(-1, 1, 1) + offsets.reshape(1, -1, 1), 0, self.ny - 1)
+        states = np.unique(xs + self.nx*ys)
+
+        blocked = blocked_at(self.walls, states, self.actions)
+        steps = np.array([dx + self.nx*dy for dx, dy in (ACTION_STEPS[action] for action in ACTION_MODELS[self.actions])])
+        new_ns = np.where(blocked, states.reshape(-1, 1), states.reshape(-1, 1) + steps).astype(ns.dtype)
+        changed = new_ns != ns[states]
+        rt = getattr(self, 'reward_matrix', None)
+        if rt is not None:
+            new_rt = np.where(blocked, self.r_wall, self.r_default).astype(rt.dtype)
+            changed |= new_rt != rt[states]
+        rows, actions = np.nonzero(changed)
+        diff['state'] = states[rows]
+        diff['action'] = actions.astype(np.int8)
+        ns[diff['state'], actions] = diff['ns'] = new_ns[rows, actions]
+        if rt is not None:
+            rt[diff['state'], actions] = diff['rt'] = new_rt[rows, actions]
+        return diff
+
+    def add_wall(self, x, y, wall):
+        """Add the given wall of the cell at (x,y), return the diff of the matrices (see set_walls)."""
+
+        return self.set_walls([(x, y, wall, True)])
+
+    def remove_wall(self, x, y, wall):
+        """Remove the given wall of the cell at (x,y), return the diff of the matrices (see set_walls)."""
+
+        return self.set_walls([(x, y, wall, False)])
+
     def write_svg(self, filename, svg_set):
         """Write an SVG image of the maze to filename."""
 
         aspect_ratio = self.nx / self.ny
         # Pad the maze all around by this amount.
         padding = 10
-        # Height and width of the maze image (excluding padding), in pixels
-        height = 1000
-        width = int(height * aspect_ratio)
+        # Height and width of the maze image (excluding padding), in pixels,
+        # the longest side is 1000 pixels
+        if aspect_ratio > 1:
+            width = 1000
+            height = int(width / aspect_ratio)
+        else:
+            height = 1000
+            width = int(height * aspect_ratio)
         # Scaling factors mapping maze coordinates to image coordinates
         scy, scx = height / self.ny, width / self.nx
         # Font size for texts
         font_size = scy/5
 
-        def write_wall(ww_f, ww_x1, ww_y1, ww_x2, ww_y2):
-            """Write a single wall to the SVG image file handle f."""
-
-            print('<line x1="{}" y1="{}" x2="{}" y2="{}"/>'.format(ww_x1, ww_y1, ww_x2, ww_y2), file=ww_f)
-
-        def write_coords(wc_f, wc_x, wc_y, wc_tx, wc_ty, wc_set):
-            """Write a state coordinate to the SVG image file handle f."""
-            if (wc_set=="s"):
-                state_number = wc_tx+(wc_ty*self.nx)
-                print('<text x="{}" y="{}" class="small">S{}</text>'.format(wc_x, wc_y, state_number), file=wc_f)
-            else:
-                print('<text x="{}" y="{}" class="small">({},{})</text>'.format(wc_x, wc_y, wc_tx, wc_ty), file=wc_f)
+        # One line of SVG per rect, label and wall. The coordinates are
+        # formatted once per row and column, and the lines are joined a whole
+        # column of cells at a time and written in large buffered chunks.
+        xs = [str(x*scx) for x in range(self.nx + 1)]
+        ys = [str(y*scy) for y in range(self.ny + 1)]
+        text_ys = [str((y+0.3)*scy) for y in range(self.ny)]
+        rect_tails = [f'" y="{ys[y]}" width="{scx}" height="{scy}" fill="none" stroke="gray" stroke-width="1"/>\n'
+                      for y in range(self.ny)]
 
         # Write the SVG image file for maze
-        with open(filename, 'w') as f:
+        with open(filename, 'w', buffering=1 << 20) as f:
             # SVG preamble and styles.
             print('<?xml version="1.0" encoding="utf-8"?>', file=f)
             print('<svg xmlns="http://www.w3.org/2000/svg"', file=f)
@@ -237,29 +443,36 @@ class Maze:
 
             # Draw layout square
             for x in range(self.nx):
-                for y in range(self.ny):
-                    print(f'<rect x="{x*scx}" y="{y*scy}" width="{scx}" height="{scy}" fill="none" stroke="gray" stroke-width="1"/>', file = f)
+                rect_head = f'<rect x="{xs[x]}'
+                f.write(rect_head + rect_head.join(rect_tails))
             print('',file=f)
 
             # Draw State Coordinates
             for x in range(self.nx):
-                for y in range(self.ny):
-                    wx, wy = (x+0.1)*scx, (y+0.3)*scy
-                    write_coords(f, wx, wy, x, y, svg_set)
+                wx = str((x+0.1)*scx)
+                if (svg_set=="s"):
+                    f.write(''.join([f'<text x="{wx}" y="{text_ys[y]}" class="small">S{x+(y*self.nx)}</text>\n'
+                                     for y in range(self.ny)]))
+                else:
+                    f.write(''.join([f'<text x="{wx}" y="{text_ys[y]}" class="small">({x},{y})</text>\n'
+                                     for y in range(self.ny)]))
             print('',file=f)
 
             # Draw the "South" and "East" walls of each cell, if present (these
             # are the "North" and "West" walls of a neighbouring cell in
             # general, of course).
+            south = self.wall_mask('S').T.tolist()
+            east = self.wall_mask('E').T.tolist()
             for x in range(self.nx):
+                x1, x2 = xs[x], xs[x + 1]
+                south_x, east_x = south[x], east[x]
+                lines = []
                 for y in range(self.ny):
-                    if self.cell_at(x, y).walls['S']:
-                        x1, y1, x2, y2 = x * scx, (y + 1) * scy, (x + 1) * scx, (y + 1) * scy
-                        write_wall(f, x1, y1, x2, y2)
-
-                    if self.cell_at(x, y).walls['E']:
-                        x1, y1, x2, y2 = (x + 1) * scx, y * scy, (x + 1) * scx, (y + 1) * scy
-                        write_wall(f, x1, y1, x2, y2)
+                    if south_x[y]:
+                        lines.append(f'<line x1="{x1}" y1="{ys[y + 1]}" x2="{x2}" y2="{ys[y + 1]}"/>\n')
+                    if east_x[y]:
+                        lines.append(f'<line x1="{x2}" y1="{ys[y]}" x2="{x2}" y2="{ys[y + 1]}"/>\n')
+                f.write(''.join(lines))
             print('',file=f)
             # Draw the North and West maze border, which won't have been drawn
             # by the procedure above.
@@ -278,30 +491,15 @@ class Maze:
         for direction, (dx, dy) in delta:
             x2, y2 = cell.x + dx, cell.y + dy
             if (0 <= x2 < self.nx) and (0 <= y2 < self.ny):
-                neighbour = self.cell_at(x2, y2)
-                if neighbour.has_all_walls():
-                    neighbours.append((direction, neighbour))
+                if self.walls[y2, x2] == ALL_WALLS:
+                    neighbours.append((direction, self.cell_at(x2, y2)))
         return neighbours
 
     def make_maze(self):
-        # Total number of cells.
-        n = self.nx * self.ny
-        cell_stack = []
-        current_cell = self.cell_at(self.ix, self.iy)
-        # Total number of visited cells during maze construction.
-        nv = 1
-
-        while nv < n:
-            neighbours = self.find_valid_neighbours(current_cell)
-
-            if not neighbours:
-                # We've reached a dead end: backtrack.
-                current_cell = cell_stack.pop()
-                continue
-
-            # Choose a random neighbouring cell and move to it.
-            direction, next_cell = random.choice(neighbours)
-            current_cell.knock_down_wall(next_cell, direction)
-            cell_stack.append(current_cell)
-            current_cell = next_cell
-            nv += 1
\ No newline at end of file
+        """Carve the maze with the algorithm chosen at initialization."""
+
+        carve_fn = carve.ALGORITHMS[self.algorithm]
+        open_s, open_e = carve_fn(self.nx, self.ny, self.rng, (self.ix, self.iy))
+        self.walls = walls_from_passages(open_s, open_e)
+        if self.imperfect:
+            self.walls = imperfect_passes.make_imperfect(self.walls, self.rng, **self.imperfect)
@@ -0,0 +1,194 @@
+import json
+import struct
+
+import numpy as np
+# Maze config and memory file I/O.
+#
+# Text outputs are formatted a block of rows at a time (one str.format call
+# per row, one join per block) and written in large buffered chunks instead
+# of one print() per value.
+
+# Rows formatted per block by write_rows
+CHUNK_ROWS = 1 << 16
+
+def rows_to_text(matrix):
+    """Format the rows of a (n, Z) matrix as config lines, 'v0;v1;...;\\n' each."""
+
+    row_fmt = '{};' * matrix.shape[1] + '\n'
+    # Floats go through NumPy's str() so that float32 values print as short as
+    # they were given (0.1, not 0.10000000149011612)
+    values = matrix.tolist() if matrix.dtype.kind in 'iu' else matrix.astype(str).tolist()
+    return ''.join([row_fmt.format(*row) for row in values])
+
+def reward_text(rt, rewards):
+    """Return the rewards of rt as strings, each written as the reward it was made from.
+
+    rewards are the values the matrix was built from (r_default, r_wall):
+    an entry equal to one of them is written as that value was given
+    (-1 for an int, -10.5 for a float), the other entries as float32.
+
+    """
+    text = rt.astype(str)
+    for value in rewards:
+        text = np.where(rt == np.float32(value), f'{value}', text)
+    return text
+
+def write_rows(f, matrix, chunk_rows=CHUNK_ROWS):
+    """Write the rows of a (n, Z) matrix to f as config lines, a block at a time."""
+
+    for start in range(0, matrix.shape[0], chunk_rows):
+        f.write(rows_to_text(matrix[start:start + chunk_rows]))
+
+def values_to_text(values):
+    """Format a sequence of values as a COE vector body, ' v0 v1 ...'."""
+
+    return ''.join([f' {v}' for v in values])
+
+def read_config_txt(fname):
+    """Return (header, NS, RT) of a text config file, like read_config_bin.
+
+    NS is int64 and RT float64, as COEgen.load_mazeConfig parses them.
+
+    """
+    with open(fname, 'r') as f:
+        nx, ny, Z = int(f.readline()), int(f.readline()), int(f.readline())
+        values = f.read().replace('\n', '').split(';')[:-1]
+    N = nx*ny
+    data = np.array(values, dtype=np.float64).reshape(2, N, Z)
+    return {'nx': nx, 'ny': ny, 'Z': Z}, data[0].astype(np.int64), data[1]
+
+# Binary maze config format (.mzb)
+#
+# Layout of a .mzb file:
+# - 8 bytes magic, b'GMAZECFG'
+# - uint32 (little endian) length of the JSON header
+# - JSON header, padded with spaces so that the data starts on a 64 bytes
+#   boundary. It holds nx, ny, Z, the dtypes of NS and RT and the
+#   generation parameters (seed, algorithm, rewards, ...)
+# - NS matrix, N*Z values of header['ns_dtype'], row major
+# - RT matrix, N*Z values of header['rt_dtype'], row major
+#
+# Both matrices are contiguous, so they can be loaded with np.memmap
+# without parsing or copying anything.
+
+CONFIG_MAGIC = b'GMAZECFG'
+CONFIG_VERSION = 1
+CONFIG_EXT = '.mzb'
+ALIGN = 64
+
+def json_seed(seed):
+    """Return seed in a JSON friendly form (SeedSequences become a dict)."""
+
+    if isinstance(seed, np.random.SeedSequence):
+        return {'entropy': seed.entropy, 'spawn_key': list(seed.spawn_key)}
+    if isinstance(seed, np.integer):
+        return int(seed)
+    return seed
+
+def config_header(nx, ny, Z, ns_dtype, rt_dtype, **params):
+    """Return (header bytes, header dict, offset of NS, offset of RT)."""
+
+    header = {
+        'version': CONFIG_VERSION,
+        'nx': int(nx),
+        'ny': int(ny),
+        'Z': int(Z),
+        'ns_dtype': np.dtype(ns_dtype).newbyteorder('<').str,
+        'rt_dtype': np.dtype(rt_dtype).newbyteorder('<').str,
+    }
+    header.update(params)
+    if 'seed' in header:
+        header['seed'] = json_seed(header['seed'])
+    text = json.dumps(header).encode('utf-8')
+    start = len(CONFIG_MAGIC) + 4
+    text += b' ' * (-(start + len(text)) % ALIGN)
+    ns_offset = start + len(text)
+    rt_offset = ns_offset + nx*ny*Z*np.dtype(ns_dtype).itemsize
+    return CONFIG_MAGIC + struct.pack('<I', len(text)) + text, header, ns_offset, rt_offset
+
+def write_config_bin(fname, ns, rt, **params):
+    """Write the (N, Z) NS and RT matrices of a nx x ny maze to a .mzb file.
+
+    params must hold nx and ny, the other keys are stored as they are in the
+    header.
+
+    """
+    nx, ny = params.pop('nx'), params.pop('ny')
+    head, _, _, _ = config_header(nx, ny, ns.shape[1], ns.dtype, rt.dtype, **params)
+    with open(fname, 'wb') as f:
+        f.write(head)
+        f.write(np.ascontiguousarray(ns, dtype=ns.dtype.newbyteorder('<')).data)
+        f.write(np.ascontiguousarray(rt, dtype=rt.dtype.newbyteorder('<')).data)
+
+def read_config_header(fname):
+    """Return (header dict, offset of NS, offset of RT) of a .mzb file."""
+
+    with open(fname, 'rb') as f:
+        magic = f.read(len(CONFIG_MAGIC))
+        if magic != CONFIG_MAGIC:
+            raise ValueError(f'{fname} is not a binary maze config file')
+        size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(size))
+    if header['version'] > CONFIG_VERSION:
+        raise ValueError(f"{fname} uses config format version {header['version']}, "
+                         f"only up to {CONFIG_VERSION} is supported")
+    N = header['nx'] * header['ny']
+    ns_offset = len(CONFIG_MAGIC) + 4 + size
+    rt_offset = ns_offset + N*header['Z']*np.dtype(header['ns_dtype']).itemsize
+    return header, ns_offset, rt_offset
+
+def config_bytes(ns, rt, walls=None, **params):
+    """Return the bytes of a .mzb config, like write_config_bin, in memory.
+
+    The (ny, nx) uint8 walls of the maze, when given, follow the matrices
+    (header['walls'] is set), to keep a whole maze in a single record.
+
+    """
+    nx, ny = params.pop('nx'), params.pop('ny')
+    if walls is not None:
+        params['walls'] = True
+    head, _, _, _ = config_header(nx, ny, ns.shape[1], ns.dtype, rt.dtype, **params)
+    parts = [head, np.ascontiguousarray(ns, dtype=ns.dtype.newbyteorder('<')).tobytes(),
+             np.ascontiguousarray(rt, dtype=rt.dtype.newbyteorder('<')).tobytes()]
+    if walls is not None:
+        parts.append(np.ascontiguousarray(walls, dtype=np.uint8).tobytes())
+    return b''.join(parts)
+
+def read_config_bytes(data):
+    """Return (header, NS, RT, walls or None) of the bytes of a .mzb config, without copying them."""
+
+    if data[:len(CONFIG_MAGIC)] != CONFIG_MAGIC:
+        raise ValueError('Not a binary maze config record')
+    start = len(CONFIG_MAGIC) + 4
+    size, = struct.unpack('<I', data[len(CONFIG_MAGIC):start])
+    header = json.loads(bytes(data[start:start + size]))
+    if header['version'] > CONFIG_VERSION:
+        raise ValueError(f"Config format version {header['version']}, only up to {CONFIG_VERSION} is supported")
+    nx, ny, Z = header['nx'], header['ny'], header['Z']
+    ns_offset = start + size
+    ns = np.frombuffer(data, dtype=header['ns_dtype'], count=nx*ny*Z, offset=ns_offset).reshape(nx*ny, Z)
+    rt_offset = ns_offset + ns.nbytes
+    rt = np.frombuffer(data, dtype=header['rt_dtype'], count=nx*ny*Z, offset=rt_offset).reshape(nx*ny, Z)
+    walls = None
+    if header.get('walls'):
+        walls = np.frombuffer(data, dtype=np.uint8, count=nx*ny, offset=rt_offset + rt.nbytes).reshape(ny, nx)
+    return header, ns, rt, walls
+
+def read_config_bin(fname, mmap=True):
+    """Return (header, NS, RT) of a .mzb file.
+
+    With mmap the matrices are copy-on-write np.memmap views of the file:
+    nothing is read until it is used, and changes are never written back.
+
+    """
+    header, ns_offset, rt_offset = read_config_header(fname)
+    shape = (header['nx'] * header['ny'], header['Z'])
+    if mmap:
+        ns = np.memmap(fname, dtype=header['ns_dtype'], mode='c', offset=ns_offset, shape=shape)
+        rt = np.memmap(fname, dtype=header['rt_dtype'], mode='c', offset=rt_offset, shape=shape)
+    else:
+        with open(fname, 'rb') as f:
+            f.seek(ns_offset)
+            ns = np.fromfile(f, dtype=header['ns_dtype'], count=shape[0]*shape[1]).reshape(shape)
+            rt = np.fromfile(f, dtype=header['rt_dtype'], count=shape[0]*shape[1]).reshape(shape)
+    return header, ns, rt
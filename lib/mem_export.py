@@ -0,0 +1,201 @@
+import numpy as np
+# Fixed-point quantization and memory initialization file export.
+#
+# Memory contents are handled as uint64 arrays of words, each holding a
+# `width` bits value (two's complement for signed values), and written to:
+# - Xilinx COE files, radix 2, 10 or 16 ('coe')
+# - Intel MIF files ('mif')
+# - Verilog $readmemh files, one hex word per line ('hex')
+# - raw little endian binary, ceil(width/8) bytes per word ('bin')
+
+# Words formatted per block by the text writers
+CHUNK_WORDS = 1 << 18
+
+# Rounding of the scaled values to integers
+ROUNDING = {
+    # Toward zero, as int() (the original COE conversion)
+    'trunc': np.trunc,
+    'floor': np.floor,
+    # Half away from zero
+    'round': lambda x: np.sign(x) * np.floor(np.abs(x) + 0.5),
+    # Half to even
+    'even': np.rint,
+}
+# Handling of the values out of the range of the words
+OVERFLOW = ('wrap', 'saturate')
+
+def quantize(values, dat_width, frac_bit, rounding='trunc', overflow='wrap'):
+    """Return values as dat_width bits fixed-point words with frac_bit fraction bits.
+
+    Negative values are in two's complement. Out of range values are
+    either wrapped modulo 2**dat_width or saturated to the closest
+    representable value.
+
+    """
+    if rounding not in ROUNDING:
+        raise ValueError(f"Unknown rounding '{rounding}'. Choose from {', '.join(ROUNDING)}.")
+    if overflow not in OVERFLOW:
+        raise ValueError(f"Unknown overflow '{overflow}'. Choose from {', '.join(OVERFLOW)}.")
+    val = ROUNDING[rounding](np.asarray(values, dtype=np.float64) * (2.0**frac_bit))
+    if overflow == 'saturate':
+        val = np.clip(val, -2.0**(dat_width - 1), 2.0**(dat_width - 1) - 1)
+    return val.astype(np.int64).astype(np.uint64) & np.uint64((1 << dat_width) - 1)
+
+def dequantize(words, dat_width, frac_bit):
+    """Return the float64 values of dat_width bits fixed-point words."""
+
+    val = np.asarray(words, dtype=np.uint64).astype(np.int64)
+    val = np.where(val >= (1 << (dat_width - 1)), val - (1 << dat_width), val)
+    return val / 2.0**frac_bit
+
+def addr_width(depth):
+    """Return the number of bits of the addresses of a depth words memory."""
+
+    return max(1, (depth - 1).bit_length())
+
+def pack_fields(fields, field_width):
+    """Pack the columns of a (n, k) array of unsigned fields into one word per row.
+
+    Column 0 goes in the low bits. The k*field_width bits words must fit
+    in 64 bits.
+
+    """
+    n, k = fields.shape
+    if k * field_width > 64:
+        raise ValueError(f'{k} fields of {field_width} bits do not fit in a 64 bits word')
+    words = np.zeros(n, dtype=np.uint64)
+    for col in range(k):
+        words |= fields[:, col].astype(np.uint64) << np.uint64(col * field_width)
+    return words
+
+def format_words(words, width, radix=16):
+    """Return the words as strings, zero padded to width bits in radix 2 and 16."""
+
+    words = np.asarray(words).tolist()
+    if radix == 10:
+        return [str(v) for v in words]
+    if radix == 16:
+        digits = -(-width // 4)
+        return [f'{v:0{digits}X}' for v in words]
+    if radix == 2:
+        return [f'{v:0{width}b}' for v in words]
+    raise ValueError(f'Unknown radix {radix}. Choose from 2, 10, 16.')
+
+def write_coe(fname, words, width, radix=10):
+    """Write words to a Xilinx COE file."""
+
+    with open(fname, 'w', buffering=1 << 20) as f:
+        f.write(f'memory_initialization_radix={radix};\n')
+        f.write('memory_initialization_vector=')
+        for start in range(0, len(words), CHUNK_WORDS):
+            f.write(''.join([f' {v}' for v in format_words(words[start:start + CHUNK_WORDS], width, radix)]))
+        f.write(';\n')
+
+def write_mif(fname, words, width, radix=16):
+    """Write words to an Intel MIF file, addresses and data in hexadecimal."""
+
+    with open(fname, 'w', buffering=1 << 20) as f:
+        f.write(f'WIDTH={width};\nDEPTH={len(words)};\n\n')
+        f.write('ADDRESS_RADIX=HEX;\nDATA_RADIX=HEX;\n\nCONTENT BEGIN\n')
+        for start in range(0, len(words), CHUNK_WORDS):
+            text = format_words(words[start:start + CHUNK_WORDS], width)
+            f.write(''.join([f'\t{addr:X} : {v};\n' for addr, v in enumerate(text, start)]))
+        f.write('END;\n')
+
+def write_hex(fname, words, width, radix=16):
+    """Write words to a Verilog $readmemh file, one word per line."""
+
+    with open(fname, 'w', buffering=1 << 20) as f:
+        for start in range(0, len(words), CHUNK_WORDS):
+            f.write(''.join([f'{v}\n' for v in format_words(words[start:start + CHUNK_WORDS], width)]))
+
+def write_bin(fname, words, width, radix=None):
+    """Write words to a raw binary file, ceil(width/8) little endian bytes each."""
+
+    nbytes = -(-width // 8)
+    data = np.asarray(words, dtype='<u8').view(np.uint8).reshape(-1, 8)[:, :nbytes]
+    with open(fname, 'wb') as f:
+        f.write(data.tobytes())
+
+def write_patch(fname, patches, radix=16):
+    """Write memory patches, one `memory;address;word` line per changed word.
+
+    patches is a list of (memory, width, addresses, words), addresses in
+    hexadecimal and words in radix, to update the memories of a loaded
+    accelerator instead of writing them again.
+
+    """
+    with open(fname, 'w') as f:
+        for memory, width, addresses, words in patches:
+            f.write(''.join([f'{memory};{addr:X};{v}\n' for addr, v in
+                             zip(np.asarray(addresses).tolist(), format_words(words, width, radix))]))
+
+def bank_words(words, width, bram):
+    """Split a memory of width bits words in banks of a (depth, bank_width) BRAM.
+
+    Returns a list of (row, col, words, width): bank (row, col) holds bits
+    col*bank_width and up of the words row*depth to (row+1)*depth-1. The
+    banks of the last row and column can be shorter and narrower.
+
+    """
+    depth, bank_width = bram
+    if depth < 1 or bank_width < 1:
+        raise ValueError(f'BRAM depth and width must be positive, not {depth}x{bank_width}')
+    words = np.asarray(words).astype(np.uint64)
+    banks = []
+    for row, start in enumerate(range(0, len(words), depth)):
+        rows = words[start:start + depth]
+        for col, low in enumerate(range(0, width, bank_width)):
+            bits = min(bank_width, width - low)
+            banks.append((row, col, (rows >> np.uint64(low)) & np.uint64((1 << bits) - 1), bits))
+    return banks
+
+def bank_patch(memory, width, addresses, words, bram):
+    """Split a patch of a memory in the patches of its banks (see bank_words).
+
+    Returns a list of (memory, width, addresses, words), memory being the
+    {memory}_R{row}C{col} bank, addresses local to the bank.
+
+    """
+    depth, bank_width = bram
+    addresses = np.asarray(addresses, dtype=np.int64)
+    words = np.asarray(words).astype(np.uint64)
+    patches = []
+    for row in np.unique(addresses // depth).tolist():
+        rows = addresses // depth == row
+        for col, low in enumerate(range(0, width, bank_width)):
+            bits = min(bank_width, width - low)
+            patches.append((f'{memory}_R{row}C{col}', bits, addresses[rows] % depth,
+                            (words[rows] >> np.uint64(low)) & np.uint64((1 << bits) - 1)))
+    return patches
+
+# Export formats: (file extension, writer)
+EXPORTS = {
+    'coe': ('.coe', write_coe),
+    'mif': ('.mif', write_mif),
+    'hex': ('.hex', write_hex),
+    'bin': ('.bin', write_bin),
+}
+
+def write_memory(prefix, words, width, formats=('coe',), radix=10):
+    """Write words to {prefix}.{ext} in each of the formats, return the file names.
+
+    radix only applies to the COE files.
+
+    """
+    filenames = []
+    for fmt in formats:
+        if fmt not in EXPORTS:
+            raise ValueError(f"Unknown memory format '{fmt}'. Choose from {', '.join(EXPORTS)}.")
+        ext, writer = EXPORTS[fmt]
+        writer(prefix + ext, words, width, radix)
+        filenames.append(prefix + ext)
+    return filenames
+
+def write_banks(prefix, words, width, bram, formats=('coe',), radix=10):
+    """Write words split in BRAM banks (see bank_words) to {prefix}_R{row}C{col}.{ext}, return the file names."""
+
+    filenames = []
+    for row, col, bank, bits in bank_words(words, width, bram):
+        filenames += write_memory(f'{prefix}_R{row}C{col}', bank, bits, formats, radix)
+    return filenames
@@ -0,0 +1,199 @@
+import json
+import zlib
+from os import makedirs
+from os.path import join, isfile, getsize
+
+import numpy as np
+
+from lib import map_gen as mg
+from lib import maze_io
+# Dataset packs: many mazes in a few large shard files.
+#
+# A folder of three files per maze doesn't scale to millions of mazes. A pack
+# is a folder of:
+# - shard-{n:05}.mzp: the records of the mazes, appended one after the other
+#   until a shard reaches shard_bytes. A record is a whole maze: the bytes of
+#   its .mzb config (see lib/maze_io.py) followed by its wall nibbles,
+#   compressed on its own with the codec of the pack
+# - index.bin: one PACK_INDEX row (shard, offset, size) per maze, the maze id
+#   being its row
+# - pack.json: the version and codec of the pack
+# Reading a maze seeks its record and decompresses it alone.
+
+PACK_VERSION = 1
+PACK_EXT = '.mzp'
+PACK_INDEX = np.dtype([('shard', '<u4'), ('offset', '<u8'), ('size', '<u8')])
+# zstd needs the zstandard package, imported when used
+CODECS = ('none', 'zlib', 'zstd')
+
+def check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown pack codec '{codec}'. Choose from {', '.join(CODECS)}.")
+
+def compress(data, codec, level=None):
+    check_codec(codec)
+    if codec == 'zlib':
+        return zlib.compress(data, 6 if level is None else level)
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    return data
+
+def decompress(data, codec):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+def encode_record(walls, ns, rt, codec='zlib', level=None, **params):
+    """Return the record bytes of a maze, see maze_io.config_bytes for params."""
+
+    ny, nx = walls.shape
+    return compress(maze_io.config_bytes(ns, rt, walls, nx=nx, ny=ny, **params), codec, level)
+
+def decode_record(data, codec='zlib'):
+    """Return (header, NS, RT, walls) of the bytes of a record."""
+
+    # Writable arrays, as the ones of read_config_bin
+    return maze_io.read_config_bytes(bytearray(decompress(data, codec)))
+
+def shard_name(shard):
+    return f'shard-{shard:05}{PACK_EXT}'
+
+def read_meta(pack_dir):
+    with open(join(pack_dir, 'pack.json')) as f:
+        meta = json.load(f)
+    if meta['version'] > PACK_VERSION:
+        raise ValueError(f"Pack format version {meta['version']}, only up to {PACK_VERSION} is supported")
+    return meta
+
+def read_index(pack_dir):
+    return np.fromfile(join(pack_dir, 'index.bin'), dtype=PACK_INDEX)
+
+class PackWriter:
+    def __init__(self, pack_dir, codec='zlib', level=None, shard_bytes=1 << 28):
+        """Open the pack of pack_dir to append mazes to it, created when missing.
+
+        The mazes of an existing pack keep their ids and its codec is kept.
+
+        """
+        self.pack_dir = pack_dir
+        self.level = level
+        self.shard_bytes = shard_bytes
+        makedirs(pack_dir, exist_ok=True)
+        if isfile(join(pack_dir, 'pack.json')):
+            codec = read_meta(pack_dir)['codec']
+            index = read_index(pack_dir)
+            self.count = len(index)
+            self.shard = int(index['shard'][-1]) if self.count else 0
+        else:
+            check_codec(codec)
+            with open(join(pack_dir, 'pack.json'), 'w') as f:
+                json.dump({'version': PACK_VERSION, 'codec': codec}, f)
+            self.count = 0
+            self.shard = 0
+        self.codec = codec
+        self.index_file = open(join(pack_dir, 'index.bin'), 'ab')
+        self.open_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open_shard(self):
+        fname = join(self.pack_dir, shard_name(self.shard))
+        self.offset = getsize(fname) if isfile(fname) else 0
+        self.shard_file = open(fname, 'ab')
+
+    def add_record(self, data):
+        """Append the bytes of an encoded record (see encode_record), return its maze id."""
+
+        if self.offset and self.offset + len(data) > self.shard_bytes:
+            self.shard_file.close()
+            self.shard += 1
+            self.open_shard()
+        self.shard_file.write(data)
+        # The record reaches the shard file before its index row, a crashed
+        # process never indexes a partial record
+        self.shard_file.flush()
+        row = np.array([(self.shard, self.offset, len(data))], dtype=PACK_INDEX)
+        self.index_file.write(row.tobytes())
+        self.index_file.flush()
+        self.offset += len(data)
+        self.count += 1
+        return self.count - 1
+
+    def add(self, walls, ns, rt, **params):
+        """Append a maze from its (ny, nx) walls and NS/RT matrices, return its maze id."""
+
+        return self.add_record(encode_record(walls, ns, rt, self.codec, self.level, **params))
+
+    def add_maze(self, maze, **params):
+        """Append a Maze with its matrices, return its maze id."""
+
+        if maze.imperfect:
+            params['imperfect'] = maze.imperfect
+        return self.add(maze.walls, maze.state_transition_matrix, maze.reward_matrix, seed=maze.seed,
+                        algorithm=maze.algorithm, actions=maze.actions, **params)
+
+    def close(self):
+        self.shard_file.close()
+        self.index_file.close()
+
+class PackReader:
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        self.codec = read_meta(pack_dir)['codec']
+        self.index = read_index(pack_dir)
+        # Shard files opened on first read
+        self.shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, maze_id):
+        """Return the encoded bytes of the record of maze_id."""
+
+        if not 0 <= maze_id < len(self.index):
+            raise IndexError(f'Maze id {maze_id} not in the pack of {len(self.index)} mazes')
+        shard, offset, size = (int(v) for v in self.index[maze_id])
+        if shard not in self.shards:
+            self.shards[shard] = open(join(self.pack_dir, shard_name(shard)), 'rb')
+        f = self.shards[shard]
+        f.seek(offset)
+        return f.read(size)
+
+    def read(self, maze_id):
+        """Return (header, NS, RT, walls) of maze_id, only its record is read and decompressed."""
+
+        return decode_record(self.record(maze_id), self.codec)
+
+    def maze(self, maze_id):
+        """Return maze_id as a Maze with its matrices, to draw it as the generated ones."""
+
+        header, ns, rt, walls = self.read(maze_id)
+        seed = header.get('seed')
+        if isinstance(seed, dict):
+            # Seed of a generated batch, see maze_io.json_seed
+            seed = np.random.SeedSequence(seed['entropy'], spawn_key=seed['spawn_key'])
+        maze = mg.Maze((header['nx'], header['ny']), header.get('algorithm', 'dfs'), seed,
+                       header.get('actions', 4), header.get('imperfect'))
+        maze.walls = walls
+        maze.state_transition_matrix, maze.reward_matrix = ns, rt
+        maze.r_default, maze.r_wall = header.get('r_default'), header.get('r_wall')
+        return maze
+
+    def close(self):
+        for f in self.shards.values():
+            f.close()
+        self.shards = {}
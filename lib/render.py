@@ -0,0 +1,155 @@
+import struct
+import zlib
+from os.path import join
+
+import numpy as np
+
+from lib.map_gen import WALL_BITS
+# Scalable maze rendering.
+#
+# Maze.write_svg draws one element per cell, label and wall, which doesn't
+# scale past a few hundred cells per side. This module renders:
+# - compact SVGs: the grid is a single pattern, collinear walls are merged
+#   into long runs of a few <path> elements and the cell labels are dropped
+#   above label_limit cells
+# - PNG images and PNG tiles, rasterized with NumPy and written with a
+#   minimal PNG encoder, for mazes too big for any SVG viewer
+
+def wall_runs(mask):
+    """Return the (row, start, stop) of every run of True along the rows of mask."""
+
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, stops = np.nonzero(edges == -1)
+    return rows, starts, stops
+
+def wall_lines(walls):
+    """Return the (horizontal, vertical) wall lines of a (ny, nx) wall array.
+
+    horizontal[y, x] is the wall on the line y between the cells above and
+    below it, vertical[x, y] the wall on the column line x. Both include the
+    outer border.
+
+    """
+    ny, nx = walls.shape
+    horizontal = np.empty((ny + 1, nx), dtype=bool)
+    horizontal[0] = (walls[0] & WALL_BITS['N']) != 0
+    horizontal[1:] = (walls & WALL_BITS['S']) != 0
+    vertical = np.empty((nx + 1, ny), dtype=bool)
+    vertical[0] = (walls[:, 0] & WALL_BITS['W']) != 0
+    vertical[1:] = ((walls & WALL_BITS['E']) != 0).T
+    return horizontal, vertical
+
+def write_svg_compact(maze, filename, svg_set, label_limit=2500, height=1000):
+    """Write a compact SVG image of the maze to filename.
+
+    The drawing is in cell units (viewBox), so every coordinate is an
+    integer. Cell labels ("s": state number, "c": (x,y) coordinate, as in
+    Maze.write_svg) are only drawn for mazes of at most label_limit cells.
+
+    """
+    nx, ny = maze.nx, maze.ny
+    # Longest side of the image is `height` pixels
+    scale = height / max(nx, ny)
+    width_px, height_px = round(nx * scale), round(ny * scale)
+    # Pad the maze all around by 10 pixels
+    padding = 10 / scale
+
+    horizontal, vertical = wall_lines(maze.walls)
+    rows, starts, stops = wall_runs(horizontal)
+    h_path = ''.join([f'M{x0} {y}H{x1}' for y, x0, x1 in zip(rows.tolist(), starts.tolist(), stops.tolist())])
+    cols, starts, stops = wall_runs(vertical)
+    v_path = ''.join([f'M{x} {y0}V{y1}' for x, y0, y1 in zip(cols.tolist(), starts.tolist(), stops.tolist())])
+
+    with open(filename, 'w', buffering=1 << 20) as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<svg xmlns="http://www.w3.org/2000/svg"\n')
+        f.write('    xmlns:xlink="http://www.w3.org/1999/xlink"\n')
+        f.write(f'    width="{width_px + 20}" height="{height_px + 20}" '
+                f'viewBox="{-padding} {-padding} {nx + 2*padding} {ny + 2*padding}">\n')
+        f.write('<defs>\n<style type="text/css"><![CDATA[\n')
+        f.write('path { fill: none; vector-effect: non-scaling-stroke; }\n')
+        f.write('.wall { stroke: #000000; stroke-linecap: square; stroke-width: 4; }\n')
+        f.write('.grid { stroke: gray; stroke-width: 1; }\n')
+        f.write('.small { font: bold 0.2px sans-serif; fill: lightgray; }\n')
+        f.write(']]></style>\n')
+        f.write('<pattern id="grid" width="1" height="1" patternUnits="userSpaceOnUse">'
+                '<path class="grid" d="M1 0H0V1"/></pattern>\n')
+        f.write('</defs>\n')
+        # Draw layout square
+        f.write(f'<rect width="{nx}" height="{ny}" fill="url(#grid)"/>\n')
+
+        # Draw State Coordinates
+        if nx * ny <= label_limit:
+            for x in range(nx):
+                if (svg_set == "s"):
+                    f.write(''.join([f'<text x="{x + 0.1:g}" y="{y + 0.3:g}" class="small">S{x + y*nx}</text>\n'
+                                     for y in range(ny)]))
+                else:
+                    f.write(''.join([f'<text x="{x + 0.1:g}" y="{y + 0.3:g}" class="small">({x},{y})</text>\n'
+                                     for y in range(ny)]))
+
+        # Draw the walls, merged into horizontal and vertical runs
+        f.write(f'<path class="wall" d="{h_path}"/>\n')
+        f.write(f'<path class="wall" d="{v_path}"/>\n')
+        f.write('</svg>\n')
+
+def render_image(walls, scale=1):
+    """Return a uint8 grayscale image of the maze, walls black on white.
+
+    Every cell and every wall is one pixel, so the image of a nx x ny maze is
+    (2*ny+1, 2*nx+1) pixels, then scaled up by an integer factor.
+
+    """
+    ny, nx = walls.shape
+    img = np.full((2*ny + 1, 2*nx + 1), 255, dtype=np.uint8)
+    # Wall corners are always black
+    img[::2, ::2] = 0
+    horizontal, vertical = wall_lines(walls)
+    img[::2, 1::2][horizontal] = 0
+    img[1::2, ::2][vertical.T] = 0
+    if scale > 1:
+        img = np.repeat(np.repeat(img, scale, axis=0), scale, axis=1)
+    return img
+
+def png_chunk(kind, data):
+    """Return a PNG chunk (length, type, data, CRC)."""
+
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def write_png(filename, img, level=6):
+    """Write a (h, w) uint8 grayscale image to filename as a PNG file."""
+
+    h, w = img.shape
+    # Every scanline starts with its filter type, 0 (None)
+    raw = np.zeros((h, w + 1), dtype=np.uint8)
+    raw[:, 1:] = img
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 0, 0, 0, 0)))
+        f.write(png_chunk(b'IDAT', zlib.compress(raw.tobytes(), level)))
+        f.write(png_chunk(b'IEND', b''))
+
+def write_maze_png(maze, filename, scale=1):
+    """Write a PNG image of the maze to filename."""
+
+    write_png(filename, render_image(maze.walls, scale))
+
+def write_maze_png_tiles(maze, target_dir, prefix, tile_cells=1024, scale=1):
+    """Write the maze as PNG tiles of tile_cells x tile_cells cells.
+
+    Tiles are named {prefix}_{tx}_{ty}.png after their column and row of
+    tiles. Neighbouring tiles share their border line of pixels. Returns the
+    list of written file names.
+
+    """
+    filenames = []
+    for ty, y0 in enumerate(range(0, maze.ny, tile_cells)):
+        for tx, x0 in enumerate(range(0, maze.nx, tile_cells)):
+            tile = maze.walls[y0:y0 + tile_cells, x0:x0 + tile_cells]
+            filename = f'{prefix}_{tx}_{ty}.png'
+            write_png(join(target_dir, filename), render_image(tile, scale))
+            filenames.append(filename)
+    return filenames
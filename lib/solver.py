@@ -0,0 +1,222 @@
+from time import perf_counter
+
+import numpy as np
+
+from lib import mem_export
+# Reference solvers over the NS/RT matrices of the maze configs.
+#
+# Value iteration and tabular Q-learning, vectorized over all the states and
+# over a batch: NS and RT are (N, Z) for a single maze or (B, N, Z) for B
+# mazes of the same size, and `agents` runs that many independent agents
+# (each with its own Q table) on every maze. With a FixedPoint format the
+# values are kept as integers in that format, to compare the results with
+# the accelerator bit for bit. Every result holds its throughput, the
+# number of Q-value updates per second.
+
+class FixedPoint:
+    """Signed fixed-point arithmetic on int64 arrays, in the format of COEgen.gen_COE.
+
+    Values are dat_width bits two's complement integers with frac_bit
+    fraction bits. Conversions round and handle overflow as
+    mem_export.quantize, products are rounded back to frac_bit bits with the
+    same rounding.
+
+    """
+
+    def __init__(self, dat_width, frac_bit, rounding='trunc', overflow='wrap'):
+        if dat_width > 32:
+            raise ValueError('Fixed-point products of more than 32 bits words overflow int64')
+        # Checks the rounding and overflow names
+        mem_export.quantize(0, dat_width, frac_bit, rounding, overflow)
+        self.dat_width = dat_width
+        self.frac_bit = frac_bit
+        self.rounding = rounding
+        self.overflow = overflow
+
+    def from_float(self, values):
+        words = mem_export.quantize(values, self.dat_width, self.frac_bit, self.rounding, self.overflow)
+        return self.signed(words)
+
+    def to_float(self, values):
+        return np.asarray(values) / 2.0**self.frac_bit
+
+    def signed(self, words):
+        # dat_width bits words to signed integers
+        val = np.asarray(words).astype(np.int64) & ((1 << self.dat_width) - 1)
+        return np.where(val >= (1 << (self.dat_width - 1)), val - (1 << self.dat_width), val)
+
+    def fit(self, values):
+        """Wrap or saturate integers to the dat_width bits range."""
+
+        if self.overflow == 'saturate':
+            return np.clip(values, -(1 << (self.dat_width - 1)), (1 << (self.dat_width - 1)) - 1)
+        return self.signed(values)
+
+    def shift(self, p):
+        # Drop the frac_bit extra fraction bits of a product, rounded
+        f = self.frac_bit
+        if f == 0:
+            return p
+        if self.rounding == 'floor':
+            return p >> f
+        if self.rounding == 'trunc':
+            return np.where(p < 0, -((-p) >> f), p >> f)
+        if self.rounding == 'round':
+            return np.where(p < 0, -((-p + (1 << (f - 1))) >> f), (p + (1 << (f - 1))) >> f)
+        # Half to even
+        q = p >> f
+        rem = p - (q << f)
+        half = 1 << (f - 1)
+        return q + ((rem > half) | ((rem == half) & ((q & 1) == 1)))
+
+    def add(self, a, b):
+        return self.fit(np.asarray(a) + b)
+
+    def sub(self, a, b):
+        return self.fit(np.asarray(a) - b)
+
+    def mul(self, a, b):
+        return self.fit(self.shift(np.asarray(a, dtype=np.int64) * b))
+
+def batch_matrices(NS, RT, agents=1):
+    """Return NS and RT as (B, N, Z) arrays, each maze repeated for its agents."""
+
+    NS = np.asarray(NS)
+    RT = np.asarray(RT, dtype=np.float64)
+    if NS.ndim == 2:
+        NS, RT = NS[np.newaxis], RT[np.newaxis]
+    if agents > 1:
+        NS, RT = np.repeat(NS, agents, axis=0), np.repeat(RT, agents, axis=0)
+    return NS, RT
+
+def terminal_mask(terminal, B, N, agents=1):
+    """Return the (B, N) mask of the terminal states: None, a state, or one state per maze."""
+
+    mask = np.zeros((B, N), dtype=bool)
+    if terminal is not None:
+        states = np.atleast_1d(terminal)
+        if states.size > 1:
+            states = np.repeat(states, agents)
+        mask[np.arange(B), np.broadcast_to(states, (B,))] = True
+    return mask
+
+def throughput(result, updates, seconds):
+    result['updates'] = int(updates)
+    result['seconds'] = seconds
+    result['updates_per_s'] = updates / seconds if seconds > 0 else float('inf')
+    return result
+
+def report(result):
+    """Print the throughput of a solver result."""
+
+    print(f"{result['updates']} updates in {result['seconds']:.3f} s, "
+          f"{result['updates_per_s']:.3e} updates/s")
+
+def value_iteration(NS, RT, gamma=0.9, terminal=None, tol=1e-6, max_iter=10000, fmt=None):
+    """Solve the mazes by value iteration.
+
+    Every iteration backs up all the (state, action) pairs at once,
+    Q = RT + gamma * V[NS] and V = max Q, until V changes by less than tol
+    (or not at all in fixed point). The value of terminal states (the goals)
+    stays 0: entering a goal ends the episode.
+
+    Returns a dict with V (B, N), Q (B, N, Z), policy (B, N) and the
+    iteration count, in floats or in fmt integers.
+
+    """
+    NS, RT = batch_matrices(NS, RT)
+    B, N, Z = NS.shape
+    term = terminal_mask(terminal, B, N)
+    # Index of the next states in the flattened (B*N) values
+    next_idx = NS + (np.arange(B) * N).reshape(-1, 1, 1)
+    if fmt is not None:
+        rt, g = fmt.from_float(RT), int(fmt.from_float(gamma))
+        V = np.zeros((B, N), dtype=np.int64)
+    else:
+        rt = RT
+        V = np.zeros((B, N))
+
+    start = perf_counter()
+    for iteration in range(1, max_iter + 1):
+        if fmt is not None:
+            Q = fmt.add(rt, fmt.mul(V.ravel()[next_idx], g))
+        else:
+            Q = rt + gamma * V.ravel()[next_idx]
+        V_new = np.where(term, 0, Q.max(axis=2))
+        delta = np.abs(V_new - V).max()
+        V = V_new
+        if delta <= (0 if fmt is not None else tol):
+            break
+    seconds = perf_counter() - start
+
+    result = {'V': V, 'Q': Q, 'policy': Q.argmax(axis=2).astype(np.int8), 'iterations': iteration}
+    return throughput(result, iteration * B * N * Z, seconds)
+
+def q_update(Q, b, s, a, r, s_next, done, alpha, gamma, fmt=None):
+    """Apply one Q-learning update per batch element b, in place.
+
+    Q[b, s, a] += alpha * (r + gamma * max Q[b, s_next] - Q[b, s, a]), without
+    the bootstrap term when s_next ends the episode. In fixed point every
+    operation is rounded and fitted to the format, in that order:
+    target = r + gamma*maxQ, then Q + alpha*(target - Q). A recorded
+    trajectory of the accelerator can be replayed through it.
+
+    """
+    q_next = np.where(done, 0, Q[b, s_next].max(axis=1))
+    q = Q[b, s, a]
+    if fmt is not None:
+        target = fmt.add(r, fmt.mul(q_next, gamma))
+        Q[b, s, a] = fmt.add(q, fmt.mul(fmt.sub(target, q), alpha))
+    else:
+        Q[b, s, a] = q + alpha * (r + gamma * q_next - q)
+
+def q_learning(NS, RT, steps, alpha=0.1, gamma=0.9, epsilon=0.1, terminal=None, agents=1, seed=None, fmt=None):
+    """Train epsilon-greedy tabular Q-learning agents for `steps` steps each.
+
+    All the agents of all the mazes move at once, each with its own Q
+    table. An agent entering a terminal state starts a new episode from a
+    random non-terminal state. Returns a dict with Q (B, N, Z), policy
+    (B, N) and the number of episodes of each agent, in floats or in fmt
+    integers (alpha and gamma converted to fmt).
+
+    """
+    NS, RT = batch_matrices(NS, RT, agents)
+    B, N, Z = NS.shape
+    term = terminal_mask(terminal, B, N, agents)
+    if term.all(axis=1).any():
+        # No start state to restart the episodes from
+        maze = int(term.all(axis=1).argmax()) // agents
+        raise ValueError(f'Every state of maze {maze} is terminal, Q-learning needs a non-terminal start state')
+    rng = np.random.default_rng(seed)
+    if fmt is not None:
+        rt, a_, g_ = fmt.from_float(RT), int(fmt.from_float(alpha)), int(fmt.from_float(gamma))
+        Q = np.zeros((B, N, Z), dtype=np.int64)
+    else:
+        rt, a_, g_ = RT, alpha, gamma
+        Q = np.zeros((B, N, Z))
+
+    b = np.arange(B)
+
+    def restart(s, mask):
+        # Draw new start states until none of them is terminal
+        while mask.any():
+            s[mask] = rng.integers(N, size=int(mask.sum()))
+            mask = mask & term[b, s]
+        return s
+
+    s = restart(np.zeros(B, dtype=np.int64), np.ones(B, dtype=bool))
+    episodes = np.zeros(B, dtype=np.int64)
+
+    start = perf_counter()
+    for _ in range(steps):
+        explore = rng.random(B) < epsilon
+        a = np.where(explore, rng.integers(Z, size=B), Q[b, s].argmax(axis=1))
+        s_next = NS[b, s, a]
+        done = term[b, s_next]
+        q_update(Q, b, s, a, rt[b, s, a], s_next, done, a_, g_, fmt)
+        episodes += done
+        s = restart(s_next.copy(), done)
+    seconds = perf_counter() - start
+
+    result = {'Q': Q, 'policy': Q.argmax(axis=2).astype(np.int8), 'episodes': episodes}
+    return throughput(result, steps * B, seconds)
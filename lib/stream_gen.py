@@ -0,0 +1,127 @@
+from os.path import join, dirname
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+
+import numpy as np
+
+from lib import map_gen as mg
+from lib import carve
+from lib import maze_io
+from lib import mem_export
+
+class streamMazeGen:
+    """Generate a maze band by band, with memory bounded by O(nx).
+
+    The maze is carved with Eller's algorithm, which only needs the current
+    row, and its NS/RT matrices are written as the bands come out instead of
+    being held for the whole grid. A stream with a given seed gives the same
+    maze as Maze(dim, 'eller', seed). dim is a size or a (nx, ny) pair.
+    Streamed matrices are 4-connected only: diagonal moves would need the
+    rows around each band.
+
+    """
+
+    def __init__(self, dim, r_default=-1, r_hitwall=-10, seed=None, band_rows=None):
+        self.nx, self.ny = mg.maze_size(dim)
+        self.Z = 4
+        self.N = self.nx*self.ny
+        self.r_default = r_default
+        self.r_hitwall = r_hitwall
+        self.seed = seed
+        # Rows per band, about 64k cells per band by default
+        self.band_rows = band_rows or max(1, (1 << 16) // self.nx)
+
+    def bands(self):
+        """Yield (first_state, walls) for each band of rows of the maze."""
+
+        rng = np.random.default_rng(self.seed)
+        # Draw the entry point like Maze does, Eller's algorithm doesn't use it
+        rng.integers(self.nx)
+        rng.integers(self.ny)
+
+        band_s = np.zeros((self.band_rows, self.nx), dtype=bool)
+        band_e = np.zeros((self.band_rows, self.nx), dtype=bool)
+        # Passages going south out of the last row of the previous band
+        above_s = np.zeros(self.nx, dtype=bool)
+        first_row = 0
+        rows = 0
+        for row_s, row_e in carve.eller_rows(self.nx, self.ny, rng):
+            band_s[rows] = row_s
+            band_e[rows] = row_e
+            rows += 1
+            if rows == self.band_rows or first_row + rows == self.ny:
+                walls = mg.walls_from_passages(band_s[:rows], band_e[:rows])
+                walls[0] -= above_s.astype(np.uint8) * np.uint8(mg.WALL_BITS['N'])
+                above_s = band_s[rows-1].copy()
+                yield first_row * self.nx, walls
+                first_row += rows
+                rows = 0
+
+    def band_matrices(self):
+        """Yield (first_state, walls, NS, RT) for each band of rows of the maze."""
+
+        for first_state, walls in self.bands():
+            blocked = mg.walls_to_blocked(walls)
+            ns = mg.walls_to_next_state(walls, first_state, blocked)
+            rt = mg.walls_to_rewards(walls, self.r_default, self.r_hitwall, blocked)
+            yield first_state, walls, ns, rt
+
+    def write_config_txt(self, fname):
+        """Write the maze config file, in the format of gridMazeGen.generate_config_txt."""
+
+        # The RT section follows the whole NS section, spool it next to the
+        # output file until the last band is written
+        with open(fname, 'w', buffering=1 << 20) as f, TemporaryFile('w+', dir=dirname(fname) or None) as rt_f:
+            f.write(f'{self.nx}\n{self.ny}\n{self.Z}\n')
+            for _, _, ns, rt in self.band_matrices():
+                maze_io.write_rows(f, ns)
+                # Rewards are stored as float32, write them as they were given
+                maze_io.write_rows(rt_f, maze_io.reward_text(rt, (self.r_default, self.r_hitwall)))
+            rt_f.seek(0)
+            copyfileobj(rt_f, f)
+
+    def write_config_bin(self, fname):
+        """Write the maze config as a binary .mzb file (see lib/maze_io.py)."""
+
+        # Same NS dtype as walls_to_next_state for the last band
+        ns_dtype = np.int32 if self.N + self.nx <= np.iinfo(np.int32).max else np.int64
+        head, _, ns_offset, rt_offset = maze_io.config_header(
+            self.nx, self.ny, self.Z, ns_dtype, np.float32, seed=self.seed, algorithm='eller',
+            r_default=self.r_default, r_wall=self.r_hitwall)
+        ns_item = np.dtype(ns_dtype).itemsize * self.Z
+        rt_item = np.dtype(np.float32).itemsize * self.Z
+        with open(fname, 'wb') as f:
+            f.write(head)
+            for first_state, _, ns, rt in self.band_matrices():
+                f.seek(ns_offset + first_state*ns_item)
+                f.write(ns.astype(np.dtype(ns_dtype).newbyteorder('<')).data)
+                f.seek(rt_offset + first_state*rt_item)
+                f.write(rt.astype('<f4').data)
+
+    def write_COE(self, coe_dir, dat_width, frac_bit, goal_state=None, goal_reward=10):
+        """Write the NS and RT COE files of the maze, in the format of COEgen.gen_COE.
+
+        The files are written in coe_dir, which must exist. When goal_state
+        is given, moving into it is rewarded with goal_reward.
+
+        """
+        ns_names = [join(coe_dir, f'S{self.N}_NS{a}_MEM.coe') for a in range(self.Z)]
+        rt_name = join(coe_dir, f'S{self.N}_RT_MEM.coe')
+        ns_files = [open(name, 'w', buffering=1 << 20) for name in ns_names]
+        rt_file = open(rt_name, 'w', buffering=1 << 20)
+        try:
+            for f in ns_files + [rt_file]:
+                f.write('memory_initialization_radix=10;\nmemory_initialization_vector=')
+            for first_state, _, ns, rt in self.band_matrices():
+                if goal_state is not None:
+                    states = np.arange(first_state, first_state + ns.shape[0]).reshape(-1, 1)
+                    rt[(ns == goal_state) & (states != goal_state)] = goal_reward
+                for a in range(self.Z):
+                    ns_files[a].write(maze_io.values_to_text(ns[:, a].tolist()))
+                # Same fixed-point conversion as COEgen.gen_COE: truncate, then wrap
+                rt_file.write(maze_io.values_to_text(mem_export.quantize(rt.ravel(), dat_width, frac_bit).tolist()))
+            for f in ns_files + [rt_file]:
+                f.write(';\n')
+        finally:
+            for f in ns_files + [rt_file]:
+                f.close()
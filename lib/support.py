@@ -1,11 +1,68 @@
 from os import getcwd, mkdir
-from os.path import join, isdir
+from os.path import join, isdir, basename
 from datetime import datetime
+from functools import partial
+from collections import deque
+
+import numpy as np
 
 from lib import map_gen as mg
+from lib import maze_io
+from lib.catalog import MazeCatalog, folder_files
+from lib.instrument import Instrument, SUMMARY
+
+def matrices_from_walls(walls, r_default, r_wall, actions=4):
+    """Return the (NS, RT) matrices of a wall array from a single wall mask."""
+
+    blocked = mg.walls_to_blocked(walls, actions)
+    return (mg.walls_to_next_state(walls, blocked=blocked, actions=actions),
+            mg.walls_to_rewards(walls, r_default, r_wall, blocked=blocked, actions=actions))
+
+def pool_map(fn, items, workers=1, progress=None):
+    """Return [fn(item) for item in items], run on `workers` processes.
+
+    progress(done, total) is called as the items complete, when given.
+
+    """
+    items = list(items)
+    results = []
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            results.append(fn(item))
+            if progress is not None:
+                progress(len(results), len(items))
+        return results
+    chunksize = max(1, len(items) // (4 * workers))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers) as executor:
+        for result in executor.map(fn, items, chunksize=chunksize):
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(items))
+    return results
+
+def carve_maze(maze):
+    """Carve maze and return it, used to carve mazes in worker processes."""
+
+    maze.make_maze()
+    return maze
+
+def build_maze(maze, r_default, r_wall):
+    """Carve maze and generate its matrices, used by the save pipeline."""
+
+    maze.make_maze()
+    maze.gen_matrices(r_default, r_wall)
+    return maze
 
 class gridMazeGen:
-    def __init__(self, n_maze, dim, target_folder_name, r_default=-1, r_hitwall=-10):
+    def __init__(self, n_maze, dim, target_folder_name, r_default=-1, r_hitwall=-10, algorithm='dfs',
+                 seed=None, workers=1, config_format='txt', svg_mode='full', label_limit=2500,
+                 cache=None, catalog=True, verbose=2, sinks=None, actions=4, imperfect=None,
+                 writers=0, queue_size=8):
+        # Messages (verbose 0: none, 1: stage summaries, 2: everything), stage
+        # timings and progress, see lib/instrument.py
+        self.instrument = Instrument(verbose, sinks)
+
         # Get current date
         self.now = datetime.now()
         self.timestamp = self.now.strftime('%y%m%d')
@@ -14,82 +71,412 @@ class gridMazeGen:
         self.n_maze = n_maze
         self.r_default = r_default
         self.r_hitwall = r_hitwall
-        print(f"Generating {n_maze} maze(s) at {self.now.strftime('%Y/%m/%d-%H:%M:%S')}")
-        self.mazes = [mg.Maze(dim) for _ in range(n_maze)]
-        for maze in self.mazes:
-            maze.make_maze()
+        # Action model of the matrices: 4 (down, right, left, up) or 8 (and
+        # the diagonals), see mg.ACTION_MODELS. dim is a size or a (nx, ny) pair
+        mg.check_actions(actions)
+        self.actions = actions
+        # Passes run after carving for imperfect mazes (loops, rooms), e.g.
+        # {'braid': 0.5, 'knock': 100}, see lib/imperfect.py
+        self.imperfect = imperfect
+        # Number of worker processes used to generate and save the mazes
+        self.workers = workers
+        # With writer threads, the mazes are generated as save_results writes
+        # them, through a queue of at most queue_size mazes (see save_pipeline)
+        self.writers = writers
+        self.queue_size = max(1, queue_size)
+        # Format of the maze config files: 'txt', 'bin' (.mzb) or 'both'
+        if config_format not in ('txt', 'bin', 'both'):
+            raise ValueError(f"Unknown config format '{config_format}'. Choose from txt, bin, both.")
+        self.config_format = config_format
+        # Maze images: 'full' SVG (one element per cell and wall), 'compact'
+        # SVG (merged walls, no labels above label_limit cells) or 'png'
+        if svg_mode not in ('full', 'compact', 'png'):
+            raise ValueError(f"Unknown svg mode '{svg_mode}'. Choose from full, compact, png.")
+        self.svg_mode = svg_mode
+        self.label_limit = label_limit
 
         self.current_dir = getcwd()
         self.results_folder_name = target_folder_name
         self.results_dir = self.check_dir(join(self.current_dir, self.results_folder_name))
 
+        # Cache of generated mazes (True for the default one in results), only
+        # seeded batches can be served from it
+        if cache is True:
+            from lib.cache import MazeCache
+            cache = MazeCache(join(self.results_dir, '.cache'))
+        self.cache = cache if seed is not None else None
+        # Keep the catalog of the results folder up to date in save_results
+        self.catalog = catalog
+
+        # Every maze gets its own random stream spawned from the batch seed,
+        # so the mazes don't depend on the number of workers
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.seed = self.seed_seq.entropy
+        self.instrument.log(f"Generating {n_maze} maze(s) at {self.now.strftime('%Y/%m/%d-%H:%M:%S')}", SUMMARY)
+        self.dim = dim
+        self.algorithm = algorithm
+        self.nx, self.ny = mg.maze_size(dim)
+        if self.writers:
+            # The mazes are made one by one by the save pipeline, and not kept.
+            # Check their parameters now rather than in save_results
+            mg.Maze(1, algorithm, actions=actions, imperfect=imperfect)
+            self.mazes = None
+            return
+        self.mazes = [mg.Maze(dim, algorithm, maze_seed, actions, imperfect) for maze_seed in self.seed_seq.spawn(n_maze)]
+        with self.instrument.stage('make_maze', mazes=n_maze, cells=sum(maze.N for maze in self.mazes)):
+            if self.cache is None:
+                self.mazes = self.map(carve_maze, self.mazes, 'make_maze')
+            else:
+                self.generate_cached()
+
+    def __getstate__(self):
+        # Workers only need the settings, not the whole batch of mazes
+        state = self.__dict__.copy()
+        state['mazes'] = None
+        state['cache'] = None
+        state['instrument'] = self.instrument.worker()
+        return state
+
+    def generate_cached(self):
+        # Serve the mazes found in the cache, generate and store the others
+        keys = [self.cache.key(maze.nx, maze.ny, maze.algorithm, maze.seed, self.r_default, self.r_hitwall,
+                               self.actions, maze.imperfect) for maze in self.mazes]
+        missing = []
+        for idx, (maze, key) in enumerate(zip(self.mazes, keys)):
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.append(idx)
+            else:
+                maze.walls, maze.state_transition_matrix, maze.reward_matrix = cached
+                maze.r_default, maze.r_wall = self.r_default, self.r_hitwall
+        self.instrument.log(f'{len(self.mazes) - len(missing)} maze(s) found in cache, generating {len(missing)} maze(s)')
+
+        carved = self.map(carve_maze, [self.mazes[idx] for idx in missing], 'make_maze')
+        gen_matrices = partial(matrices_from_walls, r_default=self.r_default, r_wall=self.r_hitwall,
+                               actions=self.actions)
+        matrices = self.map(gen_matrices, [maze.walls for maze in carved])
+        for idx, maze, (ns, rt) in zip(missing, carved, matrices):
+            maze.state_transition_matrix = ns
+            maze.reward_matrix = rt
+            maze.r_default, maze.r_wall = self.r_default, self.r_hitwall
+            self.mazes[idx] = maze
+            self.cache.put(keys[idx], maze.walls, ns, rt, seed=maze.seed, algorithm=maze.algorithm,
+                           r_default=self.r_default, r_wall=self.r_hitwall)
+        self.cache.save_index()
+
+    def map(self, fn, items, stage=None):
+        """Return [fn(item) for item in items], run on the worker processes.
+
+        The progress of the items is reported as stage, when given.
+
+        """
+        progress = None
+        if stage is not None:
+            progress = partial(self.instrument.progress, stage)
+        return pool_map(fn, items, self.workers, progress)
+
+    def cells(self):
+        # Number of cells of the batch
+        return self.n_maze * self.nx * self.ny
+
     def check_dir(self, dir):
         if isdir(dir):
-            print(f"{dir} exist. Updating directory.")
+            self.instrument.log(f"{dir} exist. Updating directory.")
         else:
             mkdir(dir)
-            print(f"{dir} doesn't exist. Creating  directory.")
+            self.instrument.log(f"{dir} doesn't exist. Creating  directory.")
         return dir
 
+    def matrices_deferred(self):
+        # Matrices were served from (or stored in) the cache with the mazes,
+        # or are generated by the save pipeline
+        return self.cache is not None or bool(self.writers)
+
     def generate_ns(self):
-        for maze in self.mazes:
-            idx = self.mazes.index(maze)
-            print(f'Generating State Transition Matrix for {self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}')
-            maze.gen_next_state()
+        if self.matrices_deferred():
+            return
+        for idx, maze in enumerate(self.mazes):
+            self.instrument.log(f'Generating State Transition Matrix for {self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}')
+        with self.instrument.stage('gen_next_state', mazes=len(self.mazes), cells=self.cells()):
+            gen_next_state = partial(mg.walls_to_next_state, actions=self.actions)
+            ns_list = self.map(gen_next_state, [maze.walls for maze in self.mazes], 'gen_next_state')
+        for maze, ns in zip(self.mazes, ns_list):
+            maze.state_transition_matrix = ns
 
     def generate_rt(self):
-        for maze in self.mazes:
-            idx = self.mazes.index(maze)
-            print(f'Generating Reward Matrix for {self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}')
-            maze.gen_rewards(self.r_default, self.r_hitwall)
+        if self.matrices_deferred():
+            return
+        for idx, maze in enumerate(self.mazes):
+            self.instrument.log(f'Generating Reward Matrix for {self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}')
+        gen_rewards = partial(mg.walls_to_rewards, r_default=self.r_default, r_wall=self.r_hitwall,
+                              actions=self.actions)
+        with self.instrument.stage('gen_rewards', mazes=len(self.mazes), cells=self.cells()):
+            rt_list = self.map(gen_rewards, [maze.walls for maze in self.mazes], 'gen_rewards')
+        for maze, rt in zip(self.mazes, rt_list):
+            maze.reward_matrix = rt
+            maze.r_default, maze.r_wall = self.r_default, self.r_hitwall
+
+    def generate_matrices(self):
+        # Generate both matrices of a maze in a single pass over its walls
+        if self.matrices_deferred():
+            return
+        for idx, maze in enumerate(self.mazes):
+            self.instrument.log(f'Generating State Transition and Reward Matrices for {self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}')
+        gen_matrices = partial(matrices_from_walls, r_default=self.r_default, r_wall=self.r_hitwall,
+                               actions=self.actions)
+        with self.instrument.stage('gen_matrices', mazes=len(self.mazes), cells=self.cells()):
+            matrices = self.map(gen_matrices, [maze.walls for maze in self.mazes], 'gen_matrices')
+        for maze, (ns, rt) in zip(self.mazes, matrices):
+            maze.state_transition_matrix = ns
+            maze.reward_matrix = rt
+            maze.r_default, maze.r_wall = self.r_default, self.r_hitwall
     
     def generate_maze_svg(self, maze_config, idx, target_dir, mode, tab_str):
         filename = f'{self.timestamp}{maze_config.nx:02}X{maze_config.ny:02}_{mode}{idx}.svg'
         f = join(target_dir, filename)
-        maze_config.write_svg(f, mode)
-        print(f'{tab_str}Created {filename}')
+        if self.svg_mode == 'compact':
+            from lib import render
+            render.write_svg_compact(maze_config, f, mode, self.label_limit)
+        else:
+            maze_config.write_svg(f, mode)
+        self.instrument.log(f'{tab_str}Created {filename}')
+
+    def generate_maze_png(self, maze_config, idx, target_dir, tab_str, tile_cells=2048):
+        prefix = f'{self.timestamp}{maze_config.nx:02}X{maze_config.ny:02}_m{idx}'
+        from lib import render
+        if max(maze_config.nx, maze_config.ny) <= tile_cells:
+            render.write_maze_png(maze_config, join(target_dir, f'{prefix}.png'))
+            self.instrument.log(f'{tab_str}Created {prefix}.png')
+        else:
+            # Huge mazes are split in tiles of tile_cells x tile_cells cells
+            filenames = render.write_maze_png_tiles(maze_config, target_dir, prefix, tile_cells)
+            self.instrument.log(f'{tab_str}Created {len(filenames)} tiles {prefix}_*.png')
 
     def generate_config_txt(self, maze_config, idx, target_dir, tab_str):
         filename = f'{self.timestamp}{maze_config.nx:02}X{maze_config.ny:02}c{idx}.txt'
         fname = join(target_dir, filename)
-        with open(fname, 'w') as f:
-            rt = maze_config.reward_matrix
+        with open(fname, 'w', buffering=1 << 20) as f:
+            # Rewards are stored as float32, write them as they were given
+            rt = maze_io.reward_text(maze_config.reward_matrix, (self.r_default, self.r_hitwall))
             ns = maze_config.state_transition_matrix
             ### Write Number of state and action
-            print(f'{maze_config.nx}', file = f)
-            print(f'{maze_config.ny}', file = f)
-            print(f'{maze_config.Z}', file = f)
+            f.write(f'{maze_config.nx}\n{maze_config.ny}\n{maze_config.Z}\n')
             ### Write state transition matrix
-            for state in range(maze_config.N):
-                for act in range (maze_config.Z):
-                    print(f'{ns[state][act]};', end ='', file = f)
-                print('', file = f)
+            maze_io.write_rows(f, ns)
             ### Write reward matrix
-            for state in range(maze_config.N):
-                for act in range (maze_config.Z):
-                    print(f'{rt[state][act]};', end ='', file = f)  
-                print('', file = f)
+            maze_io.write_rows(f, rt)
         f.close()
-        print(f'{tab_str}Created {filename}')
+        self.instrument.log(f'{tab_str}Created {filename}')
+
+    def generate_config_bin(self, maze_config, idx, target_dir, tab_str):
+        filename = f'{self.timestamp}{maze_config.nx:02}X{maze_config.ny:02}c{idx}{maze_io.CONFIG_EXT}'
+        fname = join(target_dir, filename)
+        # Parameters of the imperfect maze passes, only for imperfect mazes
+        extra = {'imperfect': maze_config.imperfect} if maze_config.imperfect else {}
+        maze_io.write_config_bin(fname, maze_config.state_transition_matrix, maze_config.reward_matrix,
+                                 nx=maze_config.nx, ny=maze_config.ny, seed=maze_config.seed,
+                                 algorithm=maze_config.algorithm, actions=maze_config.actions,
+                                 r_default=self.r_default, r_wall=self.r_hitwall, **extra)
+        self.instrument.log(f'{tab_str}Created {filename}')
     
-    def save_results(self):
-        for maze in self.mazes:
-            idx = self.mazes.index(maze)
-            target_folder = f'{self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}'
-            target_dir = join(self.results_dir, target_folder)
-            while isdir(target_dir):
-                idx += 1
-                target_folder = f'{self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}'
-                target_dir = join(self.results_dir, target_folder)
-            target_dir = self.check_dir(target_dir)
-
-            print(f'In {target_dir}:')
-            tab_str = '\t'
+    def save_maze(self, job):
+        maze, idx, target_dir = job
+        self.instrument.log(f'In {target_dir}:')
+        tab_str = '\t'
+        if self.svg_mode == 'png':
+            ### Generate Maze PNG
+            self.generate_maze_png(maze, idx, target_dir, tab_str)
+        else:
             ### Generate Maze SVG with state number
             self.generate_maze_svg(maze, idx, target_dir, "s", tab_str)
 
             ### Generate Maze SVG with (x,y) coordinate
             self.generate_maze_svg(maze, idx, target_dir, "c", tab_str)
 
-            ### Generate maze config files
+        ### Generate maze config files
+        if self.config_format in ('txt', 'both'):
             self.generate_config_txt(maze, idx, target_dir, tab_str)
+        if self.config_format in ('bin', 'both'):
+            self.generate_config_bin(maze, idx, target_dir, tab_str)
+
+        # Catalog entry of the result folder
+        return {'folder': basename(target_dir), 'nx': maze.nx, 'ny': maze.ny, 'seed': maze.seed,
+                'algorithm': maze.algorithm, 'r_default': self.r_default, 'r_wall': self.r_hitwall,
+                'date': self.now, 'files': folder_files(target_dir)}
+
+    def result_dir(self, maze, idx):
+        # First free result folder of a maze, from its index in the batch
+        target_folder = f'{self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}'
+        target_dir = join(self.results_dir, target_folder)
+        while isdir(target_dir):
+            idx += 1
+            target_folder = f'{self.timestamp}_{maze.nx:02}X{maze.ny:02}_{idx}'
+            target_dir = join(self.results_dir, target_folder)
+        return idx, self.check_dir(target_dir)
+
+    def save_results(self):
+        if self.writers:
+            return self.save_pipeline()
+        # Pick the folders first, in order, so they don't depend on the workers
+        jobs = []
+        for idx, maze in enumerate(self.mazes):
+            idx, target_dir = self.result_dir(maze, idx)
+            jobs.append((maze, idx, target_dir))
+
+        with self.instrument.stage('save_results', mazes=len(jobs), cells=self.cells(), bytes=0) as counters:
+            entries = self.map(self.save_maze, jobs, 'save_results')
+            counters['bytes'] = sum(sum(entry['files'].values()) for entry in entries)
+            if self.catalog:
+                catalog = MazeCatalog(self.results_dir)
+                catalog.add(entries)
+                catalog.close()
+
+    def new_mazes(self):
+        # Mazes of the batch, made one at a time with the seeds gridMazeGen
+        # spawns up front without writers
+        seed_seq = np.random.SeedSequence(self.seed_seq.entropy, spawn_key=self.seed_seq.spawn_key)
+        for _ in range(self.n_maze):
+            maze_seed, = seed_seq.spawn(1)
+            yield mg.Maze(self.dim, self.algorithm, maze_seed, self.actions, self.imperfect)
+
+    def built_mazes(self):
+        """Yield (position, maze) of the carved mazes with their matrices, in order.
+
+        The mazes are made as they are needed. With worker processes, at
+        most queue_size mazes are being built at once. Cached mazes are
+        served from the cache.
+
+        """
+        build = partial(build_maze, r_default=self.r_default, r_wall=self.r_hitwall)
+        executor = None
+        if self.workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(self.workers)
+        pending = deque()
+        try:
+            for pos, maze in enumerate(self.new_mazes()):
+                key, cached = None, None
+                if self.cache is not None:
+                    key = self.cache.key(maze.nx, maze.ny, maze.algorithm, maze.seed, self.r_default,
+                                         self.r_hitwall, self.actions, maze.imperfect)
+                    cached = self.cache.get(key)
+                if cached is not None:
+                    maze.walls, maze.state_transition_matrix, maze.reward_matrix = cached
+                    maze.r_default, maze.r_wall = self.r_default, self.r_hitwall
+                    pending.append((pos, None, maze))
+                elif executor is None:
+                    pending.append((pos, key, build(maze)))
+                else:
+                    pending.append((pos, key, executor.submit(build, maze)))
+                while pending and (len(pending) >= self.queue_size or executor is None):
+                    yield self.built_maze(*pending.popleft())
+            while pending:
+                yield self.built_maze(*pending.popleft())
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if self.cache is not None:
+                self.cache.save_index()
+
+    def built_maze(self, pos, key, maze):
+        if not isinstance(maze, mg.Maze):
+            # Built by a worker process
+            maze = maze.result()
+        if key is not None:
+            self.cache.put(key, maze.walls, maze.state_transition_matrix, maze.reward_matrix, seed=maze.seed,
+                           algorithm=maze.algorithm, r_default=self.r_default, r_wall=self.r_hitwall)
+        return pos, maze
+
+    def write_jobs(self, jobs, entries, errors, counters):
+        # Writer thread of save_pipeline, until it gets None
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            pos, maze, idx, target_dir = job
+            try:
+                entries[pos] = self.save_maze((maze, idx, target_dir))
+            except Exception as e:
+                # Keep draining the queue so the producer never blocks
+                errors.append(e)
+            # Nothing refers to a saved maze any more
+            job = maze = None
+            with counters['lock']:
+                counters['done'] += 1
+                self.instrument.progress('save_results', counters['done'], len(entries))
+
+    def save_pipeline(self):
+        """Generate and save the mazes at the same time, with bounded memory.
+
+        The mazes are built in order (on the worker processes, if any) and
+        handed over to self.writers threads writing their files through a
+        queue of queue_size mazes: generation waits when the writers fall
+        behind. The mazes are made as they are generated and dropped once
+        saved, self.mazes stays None.
+
+        """
+        import threading
+        from queue import Queue
+        jobs = Queue(self.queue_size)
+        entries = [None] * self.n_maze
+        errors = []
+        progress = {'lock': threading.Lock(), 'done': 0}
+        threads = [threading.Thread(target=self.write_jobs, args=(jobs, entries, errors, progress), daemon=True)
+                   for _ in range(self.writers)]
+        with self.instrument.stage('save_pipeline', mazes=self.n_maze, cells=self.cells(), bytes=0) as counters:
+            for thread in threads:
+                thread.start()
+            try:
+                for pos, maze in self.built_mazes():
+                    idx, target_dir = self.result_dir(maze, pos)
+                    jobs.put((pos, maze, idx, target_dir))
+                    if errors:
+                        break
+            finally:
+                for _ in threads:
+                    jobs.put(None)
+                for thread in threads:
+                    thread.join()
+            if errors:
+                raise errors[0]
+            counters['bytes'] = sum(sum(entry['files'].values()) for entry in entries)
+            if self.catalog:
+                catalog = MazeCatalog(self.results_dir)
+                catalog.add(entries)
+                catalog.close()
+
+    def pack_record(self, maze, codec='zlib', level=None):
+        # Encoded on the workers, the pack is written in order by save_pack
+        from lib import pack
+        extra = {'imperfect': maze.imperfect} if maze.imperfect else {}
+        if getattr(maze, 'state_transition_matrix', None) is None:
+            # generate_matrices wasn't called, the matrices are only packed
+            ns, rt = matrices_from_walls(maze.walls, self.r_default, self.r_hitwall, self.actions)
+        else:
+            ns, rt = maze.state_transition_matrix, maze.reward_matrix
+        return pack.encode_record(maze.walls, ns, rt, codec, level,
+                                  seed=maze.seed, algorithm=maze.algorithm, actions=maze.actions,
+                                  r_default=self.r_default, r_wall=self.r_hitwall, **extra)
+
+    def save_pack(self, pack_dir=None, codec='zlib', level=None, shard_bytes=1 << 28):
+        """Append the mazes to a dataset pack (see lib/pack.py) instead of a folder per maze.
+
+        The pack defaults to {timestamp}_{nx}X{ny}.pack in the results folder,
+        mazes are appended when it exists. Returns the maze ids in the pack.
+
+        """
+        from lib.pack import PackWriter
+        if self.mazes is None:
+            raise ValueError('With writers the mazes are not kept, use save_results or a gridMazeGen without writers')
+        if pack_dir is None:
+            maze = self.mazes[0]
+            pack_dir = join(self.results_dir, f'{self.timestamp}_{maze.nx:02}X{maze.ny:02}.pack')
+        with self.instrument.stage('save_pack', mazes=len(self.mazes), cells=self.cells(), bytes=0) as counters:
+            records = self.map(partial(self.pack_record, codec=codec, level=level), self.mazes, 'save_pack')
+            with PackWriter(pack_dir, codec, level, shard_bytes) as writer:
+                if writer.codec != codec:
+                    raise ValueError(f"Pack {pack_dir} is compressed with {writer.codec}, not {codec}")
+                ids = [writer.add_record(record) for record in records]
+            counters['bytes'] = sum(len(record) for record in records)
+        self.instrument.log(f'Added {len(ids)} maze(s) to {pack_dir}', SUMMARY)
+        return ids